@@ -23,7 +23,7 @@ from ..utils import draw_util
 from ..utils import dpi
 from ..utils.dpi import *
 
-__all__ = ['ElementItem']
+__all__ = ['ElementItem','HoverCandidate']
 
 class EmptyElement :
     def __init__(self, *args, **kwargs):
@@ -237,57 +237,54 @@ class ElementItem :
     def type(self):
         return self.__type
 
+    def __cached( self , kind , mirror , calc ) :
+        snapshot = self.__qmesh.snapshot_cache
+        key = ( kind , self.__index , snapshot.topology_version , mirror )
+        return snapshot.loop_cache.get( key , calc )
+
     @property
     def loops( self ) :
         if self.isEdge :        
-            if not hasattr( self , "__loop" ) :
-                self.__loop , v = self.__qmesh.calc_edge_loop( self.element , is_mirror = False )
-            return self.__loop
+            return self.__cached( 'loop' , False , lambda : self.__qmesh.calc_edge_loop( self.element , is_mirror = False )[0] )
         return []
 
     @property
     def mirror_loops( self ) :
         if self.isEdge :        
-            if not hasattr( self , "__mirror_loop" ) :
-                if self.mirror != None :
-                    self.__mirror_loop = [ t for t , s in [ (self.__qmesh.find_mirror(e,False) , e) for e in self.loops ] if t ]
-                else :
-                    self.__mirror_loop = []
-            return self.__mirror_loop
+            if self.mirror != None :
+                return self.__cached( 'loop' , True , lambda : [ t for t in [ self.__qmesh.find_mirror(e,False) for e in self.loops ] if t ] )
+            return []
         return []
 
     @property
     def both_loops( self ) :
-        mp = [ m for m in self.mirror_loops if m not in self.loops ]
+        loops = self.loops
+        mp = [ m for m in self.mirror_loops if m not in loops ]
         if mp :
-            return self.loops + mp
-        return self.loops
+            return loops + mp
+        return loops
 
     @property
     def rings( self ) :
         if self.isEdge :        
-            if not hasattr( self , "__rings" ) :
-                self.__rings , v = self.__qmesh.calc_edge_boundary_loop( self.element , is_mirror = False )
-            return self.__rings
+            return self.__cached( 'ring' , False , lambda : self.__qmesh.calc_edge_boundary_loop( self.element , is_mirror = False )[0] )
         return []
 
     @property
     def mirror_rings( self ) :
         if self.isEdge :
-            if not hasattr( self , "__mirror_rings" ) :
-                if self.mirror != None :
-                    self.__mirror_rings = [ t for t , s in [ (self.__qmesh.find_mirror(e,False) , e) for e in self.rings ] if t ]
-                else :
-                    self.__mirror_rings = []
-            return self.__mirror_rings
+            if self.mirror != None :
+                return self.__cached( 'ring' , True , lambda : [ t for t in [ self.__qmesh.find_mirror(e,False) for e in self.rings ] if t ] )
+            return []
         return []
 
     @property
     def both_rings( self ) :
-        mp = [ m for m in self.mirror_rings if m not in self.rings ]
+        rings = self.rings
+        mp = [ m for m in self.mirror_rings if m not in rings ]
         if mp :
-            return self.rings + mp
-        return self.rings
+            return rings + mp
+        return rings
 
     @property
     def type_name(self)  :
@@ -452,4 +449,50 @@ class ElementItem :
 
 
 
-    
\ No newline at end of file
+    
+
+
+class HoverCandidate :
+    """
+    Lightweight hover candidate returned by CollectVerts/CollectEdge.
+    Only the picked one is turned into an ElementItem (with its mirror).
+    """
+    __slots__ = ('qmesh','element','coord','hitPosition','dist')
+
+    def __init__(self , qmesh , element , coord : Vector , hitPosition : Vector , dist = 0 ) :
+        self.qmesh = qmesh
+        self.element = element
+        self.coord = coord
+        self.hitPosition = hitPosition
+        self.dist = dist
+
+    @property
+    def index(self) -> int :
+        return self.element.index
+
+    @property
+    def type(self):
+        return type(self.element)
+
+    @property
+    def isEmpty(self) -> bool:
+        return False
+
+    @property
+    def isNotEmpty(self) -> bool :
+        return True
+
+    @property
+    def isVert(self) -> bool :
+        return isinstance( self.element , bmesh.types.BMVert )
+
+    @property
+    def isEdge(self) -> bool :
+        return isinstance( self.element , bmesh.types.BMEdge )
+
+    @property
+    def isFace(self) -> bool :
+        return isinstance( self.element , bmesh.types.BMFace )
+
+    def to_item( self ) -> ElementItem :
+        return ElementItem( self.qmesh , self.element , self.coord , self.hitPosition , self.dist )
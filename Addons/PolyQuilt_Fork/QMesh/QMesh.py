@@ -25,7 +25,7 @@ import numpy as np
 from ..utils import pqutil
 from ..utils import draw_util
 from ..utils.dpi import *
-from .ElementItem import ElementItem
+from .ElementItem import ElementItem , HoverCandidate
 from .QMeshOperators import QMeshOperators
 from .QMeshHighlight import QMeshHighlight
 
@@ -37,23 +37,30 @@ class QMesh(QMeshOperators) :
         super().__init__(obj, preferences)
         self.highlight = QMeshHighlight(self)
         self.invalid = False
+        self.__checked_serial = self.snapshot_cache.journal_serial
 
     def __del__(self) :
         super().__del__()
         if self.highlight :
             del self.highlight
 
-    def UpdateMesh( self , changeTopology = True , loop_triangles = True,destructive = True ) :
-        super().UpdateMesh(changeTopology,loop_triangles,destructive)
+    def UpdateMesh( self , changeTopology = True , loop_triangles = True,destructive = True , moved_verts = None ) :
+        super().UpdateMesh(changeTopology,loop_triangles,destructive,moved_verts)
         if changeTopology :
             self.highlight.setDirty()
 
     def CheckValid( self , context ) :
         val = super()._CheckValid(context)
+        snapshot = self.snapshot_cache
+        if val and self.invalid and snapshot.is_journaled_since( self.__checked_serial ) and snapshot.matches( self.bm ) :
+            # depsgraph 更新の原因が記録済みの移動だけなら作り直さない
+            # (同じ間に他の操作で要素数や位置が変わっていたら作り直す)
+            self.invalid = False
         if val == False or self.invalid :
             self.highlight.setDirty()
             self.reload_obj(context)
             self.invalid = False
+        self.__checked_serial = self.snapshot_cache.journal_serial
         return val
 
     def UpdateView( self ,context , forced = False ):
@@ -81,15 +88,20 @@ class QMesh(QMeshOperators) :
         hitElement = ElementItem.Empty()
 
         ignoreFaces =  [ i for i in ignore if isinstance( i , bmesh.types.BMFace ) ]        
+        # 除外面があるときは深度バッファでは判定できない
+        use_depth = self.preferences.use_depth_buffer and not ignoreFaces
 
         # Hitする頂点を探す
         hitVert = ElementItem.Empty()
         if 'VERT' in elements :
             ignoreVerts =  [ i for i in ignore if isinstance( i , bmesh.types.BMVert ) ]
-            candidateVerts = self.highlight.CollectVerts( coord , radius , ignoreVerts , edgering , backface_culling = backface_culling  )
+            candidateVerts = self.highlight.CollectVerts( coord , radius , ignoreVerts , edgering , backface_culling = backface_culling , occlusion = use_depth )
             for vert in candidateVerts :
                 if check_func and not check_func( vert ) :
                     continue
+                if use_depth :
+                    hitVert = vert
+                    break
 
                 # 各点からRayを飛ばす
                 if QSnap.is_target( vert.hitPosition ) :
@@ -115,11 +127,14 @@ class QMesh(QMeshOperators) :
         hitEdge = ElementItem.Empty()
         if 'EDGE' in elements :
             ignoreEdges =  [ i for i in ignore if isinstance( i , bmesh.types.BMEdge ) ]
-            candidateEdges = self.highlight.CollectEdge( coord , radius , ignoreEdges , backface_culling = backface_culling , edgering= edgering )
+            candidateEdges = self.highlight.CollectEdge( coord , radius , ignoreEdges , backface_culling = backface_culling , edgering= edgering , occlusion = use_depth )
 
             for edge in candidateEdges :
                 if check_func and not check_func( edge ) :
                     continue
+                if use_depth :
+                    hitEdge = edge
+                    break
                 if QSnap.is_target( edge.hitPosition ) :                
                     hitTemp = self.highlight.PickFace( edge.coord , ignoreFaces , backface_culling = False )
                     if hitTemp.isEmpty :
@@ -150,7 +165,7 @@ class QMesh(QMeshOperators) :
                             hitElement = hitFace
         elif hitVert.isNotEmpty and hitEdge.isNotEmpty :
             if hitVert.element in hitEdge.element.verts :
-                return hitVert
+                return hitVert.to_item()
             v1 = matrix @ hitVert.hitPosition.to_4d()
             v2 = matrix @ hitEdge.hitPosition.to_4d()
             if v1.z <= v2.z :
@@ -161,7 +176,10 @@ class QMesh(QMeshOperators) :
             hitElement = hitVert
         elif hitEdge.isNotEmpty :
             hitElement = hitEdge
-        
+
+        # ミラーなどを持つ ElementItem は採択したものだけ作る
+        if isinstance( hitElement , HoverCandidate ) :
+            return hitElement.to_item()
         return hitElement
 
 
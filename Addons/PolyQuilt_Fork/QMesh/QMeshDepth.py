@@ -0,0 +1,162 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+__all__ = ['QMeshDepth']
+
+class QMeshDepth :
+    """
+    Reduced resolution software depth buffer.
+    Stores the nearest eye distance per texel so the visibility of many
+    hover candidates becomes one lookup instead of BVH ray casts per candidate.
+    Eye distance is -view z ; the near clip applies to perspective views only
+    (orthographic views also draw geometry behind the eye point).
+    """
+    # 1回に展開するピクセル数の上限
+    chunk_pixels = 1 << 21
+    # 自分自身の面との比較用の許容誤差(距離に対する割合)
+    depth_bias = 0.01
+    near_clip = 1e-6
+
+    def __init__( self , perspective_matrix , view_matrix , is_perspective , width , height , scale ) :
+        self.perspective_matrix = np.asarray( perspective_matrix , dtype = np.float64 )
+        self.view_matrix = np.asarray( view_matrix , dtype = np.float64 )
+        self.is_perspective = is_perspective
+        self.scale = max( int(scale) , 1 )
+        self.region_size = np.array( ( width , height ) , dtype = np.float64 )
+        self.width = max( int( width ) // self.scale , 1 )
+        self.height = max( int( height ) // self.scale , 1 )
+        self.depth = np.full( self.width * self.height , np.inf , dtype = np.float32 )
+        self.__far = None
+        # ( 画面の最小 , 最大 , 最も遠い距離 ) , これに重ならない三角形は描かない
+        self.__clip = None
+        self.snap_token = None
+
+    def to_buffer( self , world_positions ) :
+        """World positions (n,3) -> buffer coords (n,2) and eye distance (n,)."""
+        pts = np.asarray( world_positions , dtype = np.float64 ).reshape(-1,3)
+        m = self.perspective_matrix
+        clip = pts @ m[:,:3].T + m[:,3]
+        w = clip[:,3:4]
+        with np.errstate( divide = 'ignore' , invalid = 'ignore' ) :
+            xy = ( clip[:,:2] / w * 0.5 + 0.5 ) * self.region_size / self.scale
+        v = self.view_matrix
+        dist = -( pts @ v[2,:3] + v[2,3] )
+        return xy , dist
+
+    def __in_front( self , dist ) :
+        if self.is_perspective :
+            return dist > self.near_clip
+        return np.ones( len(dist) , dtype = bool )
+
+    def clip_to( self , world_positions ) :
+        """Rasterize only triangles that can hide world_positions (n,3) from now on."""
+        xy , dist = self.to_buffer( world_positions )
+        ok = np.isfinite( xy ).all( axis = 1 ) & self.__in_front( dist )
+        if not ok.any() :
+            self.__clip = ( np.full( 2 , np.inf ) , np.full( 2 , -np.inf ) , -np.inf )
+        else :
+            self.__clip = ( xy[ok].min( axis = 0 ) , xy[ok].max( axis = 0 ) , dist[ok].max() )
+
+    def rasterize( self , world_positions , tris ) :
+        """Rasterize triangles (t,3) indexing world_positions (n,3)."""
+        if len(tris) == 0 :
+            return
+        xy , dist = self.to_buffer( world_positions )
+        tris = np.asarray( tris ).reshape(-1,3)
+
+        # 視点の後ろにかかる三角形は描かない
+        tris = tris[ np.all( self.__in_front( dist )[tris] , axis = 1 ) ]
+        a = xy[tris[:,0]]
+        b = xy[tris[:,1]]
+        c = xy[tris[:,2]]
+        if self.__clip is not None :
+            # 対象の点より奥か画面上で重ならない三角形は隠さない
+            clip_lo , clip_hi , clip_far = self.__clip
+            near = np.minimum( np.minimum( dist[tris[:,0]] , dist[tris[:,1]] ) , dist[tris[:,2]] )
+            keep = near < clip_far
+            keep &= np.all( np.maximum( np.maximum( a , b ) , c ) >= clip_lo , axis = 1 )
+            keep &= np.all( np.minimum( np.minimum( a , b ) , c ) <= clip_hi , axis = 1 )
+            tris , a , b , c = tris[keep] , a[keep] , b[keep] , c[keep]
+        area = ( b[:,0] - a[:,0] ) * ( c[:,1] - a[:,1] ) - ( b[:,1] - a[:,1] ) * ( c[:,0] - a[:,0] )
+
+        lo = np.floor( np.minimum( np.minimum( a , b ) , c ) - 0.5 ).astype( np.int64 ) + 1
+        hi = np.floor( np.maximum( np.maximum( a , b ) , c ) - 0.5 ).astype( np.int64 )
+        np.maximum( lo , 0 , out = lo )
+        np.minimum( hi , ( self.width - 1 , self.height - 1 ) , out = hi )
+        span = hi - lo + 1
+        keep = ( np.abs(area) > 1e-12 ) & np.all( span > 0 , axis = 1 )
+        tris , a , b , c , area , lo , span = tris[keep] , a[keep] , b[keep] , c[keep] , area[keep] , lo[keep] , span[keep]
+
+        # 透視投影では 1/距離 が画面上で線形
+        q = 1.0 / dist if self.is_perspective else dist
+        qa , qb , qc = q[tris[:,0]] , q[tris[:,1]] , q[tris[:,2]]
+
+        counts = span[:,0] * span[:,1]
+        ends = np.cumsum( counts )
+        start = 0
+        while start < len(tris) :
+            base = ends[start] - counts[start]
+            stop = max( int( np.searchsorted( ends , base + self.chunk_pixels , side = 'right' ) ) , start + 1 )
+            self.__fill( slice( start , stop ) , a , b , c , area , lo , span , counts , qa , qb , qc )
+            start = stop
+        self.__far = None
+
+    def __fill( self , sl , a , b , c , area , lo , span , counts , qa , qb , qc ) :
+        n = counts[sl]
+        t = np.repeat( np.arange( len(n) ) , n )
+        k = np.arange( int(n.sum()) ) - np.repeat( np.cumsum(n) - n , n )
+        bw = span[sl][t,0]
+        px = lo[sl][t,0] + k % bw
+        py = lo[sl][t,1] + k // bw
+        x = px + 0.5
+        y = py + 0.5
+
+        a , b , c = a[sl][t] , b[sl][t] , c[sl][t]
+        w0 = ( ( b[:,0] - x ) * ( c[:,1] - y ) - ( b[:,1] - y ) * ( c[:,0] - x ) ) / area[sl][t]
+        w1 = ( ( c[:,0] - x ) * ( a[:,1] - y ) - ( c[:,1] - y ) * ( a[:,0] - x ) ) / area[sl][t]
+        w2 = 1.0 - w0 - w1
+        inside = ( w0 >= 0 ) & ( w1 >= 0 ) & ( w2 >= 0 )
+
+        t = t[inside]
+        z = w0[inside] * qa[sl][t] + w1[inside] * qb[sl][t] + w2[inside] * qc[sl][t]
+        if self.is_perspective :
+            z = 1.0 / z
+        np.minimum.at( self.depth , py[inside] * self.width + px[inside] , z.astype( np.float32 ) )
+
+    @property
+    def far( self ) :
+        # 3x3 近傍の最も遠い値 (シルエット付近で誤って隠さないため)
+        if self.__far is None :
+            d = self.depth.reshape( self.height , self.width )
+            pad = np.pad( d , 1 , mode = 'edge' )
+            far = d.copy()
+            for dy in range(3) :
+                for dx in range(3) :
+                    np.maximum( far , pad[ dy : dy + self.height , dx : dx + self.width ] , out = far )
+            self.__far = far.reshape(-1)
+        return self.__far
+
+    def test( self , world_positions , threshold = 0.0 ) :
+        """Mask of positions not hidden behind the rasterized surfaces."""
+        xy , dist = self.to_buffer( world_positions )
+        ok = np.isfinite( xy ).all( axis = 1 )
+        px = np.floor( np.where( ok[:,None] , xy , -1 ) ).astype( np.int64 )
+        inside = ok & ( px[:,0] >= 0 ) & ( px[:,0] < self.width ) & ( px[:,1] >= 0 ) & ( px[:,1] < self.height )
+        visible = np.ones( len(dist) , dtype = bool )
+        visible[ ~self.__in_front( dist ) ] = False
+        idx = np.flatnonzero( inside )
+        far = self.far[ px[idx,1] * self.width + px[idx,0] ]
+        visible[idx] &= dist[idx] <= far * ( 1.0 + self.depth_bias ) + threshold
+        return visible
@@ -22,144 +22,261 @@ import numpy as np
 from ..utils import pqutil
 from ..utils.dpi import *
 from ..utils import np_math
-from .ElementItem import ElementItem
+from .ElementItem import ElementItem , HoverCandidate
 from .QSnap import QSnap
+from .QMeshDepth import QMeshDepth
 import time
 
 __all__ = ['QMeshHighlight']
 
+class QMeshProjection :
+    """
+    Region-space positions of one snapshot for one view.
+    Kept in the snapshot's LRU so viewports showing the same mesh can reuse them.
+    """
+    def __init__( self , key , matrix , width , height ) :
+        self.key = key
+        self.matrix = matrix
+        self.width = width
+        self.height = height
+        self.projected = None
+        self.vertVisible = None
+        self.edgeVisible = None
+        self.viewPosVerts = None
+        self.viewPosVertsIdx = None
+        self.viewPosEdges = None
+        self.viewPosEdgeIdx = None
+        self.boundaryViewPosVerts = None
+        self.boundaryViewPosEdges = None
+        self.vertGrid = None
+        self.edgeGrid = None
+        self.perspective_matrix = None
+        self.view_matrix = None
+        self.is_perspective = True
+        self.depth = None
+        # None なら投影し直しが必要
+        self.journal_cursor = None
+
 class QMeshHighlight :
-    __grobal_tag__ = 0
+    # 移動頂点がこの割合を超えたら部分更新せずに再投影する
+    patch_limit = 0.25
+    # find_quad2 でまとめて判定する候補数
+    find_quad_batch = 16
 
     def __init__(self,pqo) :
         self.pqo = pqo
-        self.__viewPosVertsNP = None
-        self.__viewPosVertsIdx = None
-        self.__viewPosEdgeNP = None
-        self.__viewPosEdgeIdx = None
-        self.current_matrix = None
-        self.__boundaryViewPosVerts = None
-        self.__boundaryViewPosEdges = None
-        self.__vertsPos = None
-        self.__edgesIdx = None
-        self.__local_tag__ = 0
+        self.__view = None
+        self.__topology_version = -1
+        self.__workspace = np_math.ProjectionWorkspace()
 
     def __del__(self) :
-        del self.__vertsPos
-        del self.__edgesIdx
-        del self.__viewPosVertsNP
-        del self.__viewPosVertsIdx
-        del self.__viewPosEdgeNP
-        del self.__viewPosEdgeIdx
-        del self.__boundaryViewPosVerts
-        del self.__boundaryViewPosEdges
+        del self.__view
+        del self.__workspace
 
     @property
-    def viewPosVerts(self):
-        if self.__viewPosVertsNP is None :
+    def view(self) -> QMeshProjection :
+        if self.__view is None :
             self.UpdateView( bpy.context , True )
-        return self.__viewPosVertsNP , self.__viewPosVertsIdx
+        return self.__view
+
+    @property
+    def viewPosVerts(self):
+        view = self.view
+        return view.viewPosVerts , view.viewPosVertsIdx
 
     @property
     def viewPosEdges(self):
-        if self.__viewPosEdgeNP is None :
-            self.UpdateView( bpy.context , True )
-        return self.__viewPosEdgeNP , self.__viewPosEdgeIdx
+        view = self.view
+        return view.viewPosEdges , view.viewPosEdgeIdx
+
+    @property
+    def workspace(self):
+        return self.__workspace
+
+    @property
+    def vertGrid(self):
+        view = self.view
+        if view.vertGrid is None :
+            view.vertGrid = np_math.SpatialGrid2D.from_points( view.viewPosVerts , self.grid_cell_size )
+        return view.vertGrid
+
+    @property
+    def edgeGrid(self):
+        view = self.view
+        if view.edgeGrid is None :
+            view.edgeGrid = np_math.SpatialGrid2D.from_lines( view.viewPosEdges , self.grid_cell_size )
+        return view.edgeGrid
+
+    @property
+    def grid_cell_size(self) :
+        return max( display.dot( self.pqo.preferences.distance_to_highlight ) * 4 , 16.0 )
 
     @property
     def boundaryViewPosVerts(self):
         self.checkDirty()
-        if self.__boundaryViewPosVerts is None :
-            verts = self.pqo.bm.verts            
-            t = np.fromiter( [ vi for vi , vp in [ (i , verts[j]) for i,j in enumerate(self.__viewPosVertsIdx) ] if vp.is_boundary or vp.is_wire or not vp.is_manifold ] , dtype = np.int32 )
-            self.__boundaryViewPosVerts = t
-        return self.__boundaryViewPosVerts
+        view = self.view
+        if view.boundaryViewPosVerts is None :
+            verts_ring = self.pqo.snapshot_cache.verts_ring
+            view.boundaryViewPosVerts = np.flatnonzero( verts_ring[ view.viewPosVertsIdx ] ).astype( np.int32 )
+        return view.boundaryViewPosVerts
 
     @property
     def boundaryViewPosEdges(self):
         self.checkDirty()
-        if self.__boundaryViewPosEdges is None  :
-            edges = self.pqo.bm.edges
-            self.__boundaryViewPosEdges = np.fromiter( [ ei for ei , ep in [ (i , edges[j]) for i,j in enumerate(self.__viewPosEdgeIdx) ] if ep.is_boundary or ep.is_wire ] , dtype = np.int32 )
-        return self.__boundaryViewPosEdges
+        view = self.view
+        if view.boundaryViewPosEdges is None  :
+            edges_ring = self.pqo.snapshot_cache.edges_ring
+            view.boundaryViewPosEdges = np.flatnonzero( edges_ring[ view.viewPosEdgeIdx ] ).astype( np.int32 )
+        return view.boundaryViewPosEdges
 
     def setDirty( self ) :
-        QMeshHighlight.__grobal_tag__ = QMeshHighlight.__grobal_tag__ + 1
-        self.checkDirty()
+        self.__view = None
+        self.__topology_version = -1
 
     def checkDirty( self ) :
-        if QMeshHighlight.__grobal_tag__ != self.__local_tag__ :
-            def check( val ) :
-                if val is None:
-                    del val
-                return None
-
-            self.__vertsPos = check(self.__vertsPos)
-            self.__edgesIdx = check(self.__edgesIdx)
-            self.__viewPosVertsNP = check(self.__viewPosVertsNP)
-            self.__viewPosVertsIdx = check(self.__viewPosVertsIdx)
-            self.__viewPosEdgeNP = check(self.__viewPosEdgeNP)
-            self.__viewPosEdgeIdx = check(self.__viewPosEdgeIdx)
-            self.__boundaryViewPosVerts = check(self.__boundaryViewPosVerts)
-            self.__boundaryViewPosEdges = check(self.__boundaryViewPosEdges)
-
-            self.current_matrix = None
-            self.__local_tag__ = QMeshHighlight.__grobal_tag__
+        snapshot = self.pqo.snapshot_cache
+        if snapshot.topology_version != self.__topology_version :
+            self.__view = None
+            self.__topology_version = snapshot.topology_version
+        elif self.__view is not None :
+            self.__sync( self.__view , snapshot )
+
+    def __sync( self , view , snapshot ) :
+        if view.journal_cursor is None or view.journal_cursor == snapshot.journal_serial :
+            return
+        # 記録された移動頂点の行だけ投影し直す
+        moved = snapshot.moved_since( view.journal_cursor )
+        if moved is None or len(moved) > len(view.projected) * self.patch_limit :
+            view.journal_cursor = None
+            snapshot.projections.pop( view.key , None )
+            return
+        view.journal_cursor = snapshot.journal_serial
+        if len(moved) > 0 :
+            self.__patch( view , snapshot , moved )
+            view.depth = None
+
+    def __project( self , view , points ) :
+        n = len(points)
+        return self.__workspace.project( points , view.matrix , view.width , view.height , np.empty( (n,3) , dtype = np.float32 ) , np.empty( n , dtype = bool ) )
+
+    def __compact( self , view , snapshot ) :
+        projected = view.projected[:,:2]
+
+        # 頂点出力
+        vidxs = np.flatnonzero( view.vertVisible )
+        view.viewPosVerts , view.viewPosVertsIdx = np.take( projected , vidxs , axis = 0 ) , vidxs
+
+        # エッジ出力
+        eidxs = np.flatnonzero( view.edgeVisible )
+        ends = self.__workspace.gather( 'viewPosEdgeVerts' , snapshot.edges_idx , eidxs )
+        view.viewPosEdges , view.viewPosEdgeIdx = np.take( projected , ends , axis = 0 ) , eidxs
+
+        view.boundaryViewPosEdges = None
+        view.boundaryViewPosVerts = None
+        view.vertGrid = None
+        view.edgeGrid = None
+
+    def __patch( self , view , snapshot , moved ) :
+        coords , con = self.__project( view , snapshot.verts_co[moved] )
+        vis_changed = np.any( view.vertVisible[moved] != con )
+        view.projected[moved] = coords
+        view.vertVisible[moved] = con
+
+        eids = snapshot.vert_edges( moved )
+        eds = snapshot.edges_idx[eids]
+        econ = view.vertVisible[eds[:,0]] & view.vertVisible[eds[:,1]]
+        vis_changed = vis_changed or np.any( view.edgeVisible[eids] != econ )
+        view.edgeVisible[eids] = econ
+
+        if vis_changed :
+            # 表示集合が変わったので詰め直す(境界リストも作り直し)
+            self.__compact( view , snapshot )
+        else :
+            # 表示集合はそのまま、座標だけ差し替え
+            rows = np.searchsorted( view.viewPosVertsIdx , moved[con] )
+            view.viewPosVerts[rows] = coords[con][:,:2]
+            view.vertGrid = self.__patch_grid( view.vertGrid , rows )
+            rows = np.searchsorted( view.viewPosEdgeIdx , eids[econ] )
+            view.viewPosEdges[rows] = view.projected[ eds[econ] ][:,:,0:2]
+            view.edgeGrid = self.__patch_grid( view.edgeGrid , rows )
+
+    def __patch_grid( self , grid , rows ) :
+        if grid is None :
+            return None
+        grid.add_extras( rows )
+        if len(grid.extras) > grid.count * self.patch_limit :
+            return None
+        return grid
 
     def UpdateView( self ,context , forced = False ):
         start = time.time()
 
+        region = context.region
         rv3d = context.region_data
         pj_matrix = rv3d.perspective_matrix @ self.pqo.obj.matrix_world
         self.checkDirty()
-        if forced == True or pj_matrix != self.current_matrix :
-            region = context.region
-            height = np.float32( region.height )
-            width = np.float32( region.width )
 
-            # 頂点の取り出し
-            vts = self.pqo.bm.verts
-            vlen = len(vts)
+        key = ( region.as_pointer() , region.width , region.height , tuple( v for row in pj_matrix for v in row ) )
+        view = self.__view
+        if not forced and view is not None and view.key == key and view.journal_cursor is not None :
+            return
+
+        # 他のビューポートで投影済みならそれを使う
+        projections = self.pqo.snapshot_cache.projections
+        view = None if forced else projections.get( key )
+        if view is not None :
+            projections.move_to_end( key )
+            self.__sync( view , self.pqo.snapshot_cache )
+
+        if view is None or view.journal_cursor is None :
+            view = QMeshProjection( key , np.array( pj_matrix, dtype=np.float32 ).transpose() , np.float32( region.width ) , np.float32( region.height ) )
+            view.perspective_matrix = np.array( rv3d.perspective_matrix )
+            view.view_matrix = np.array( rv3d.view_matrix )
+            view.is_perspective = rv3d.is_perspective
+            workspace = self.__workspace
+            with workspace.measure() :
+                # 頂点の取り出し
+                snapshot = self.pqo.snapshot
+                vlen = len(snapshot.verts_co)
+                view.projected , view.vertVisible = workspace.project( snapshot.verts_co , view.matrix , view.width , view.height ,
+                    np.empty( (vlen,3) , dtype = np.float32 ) , np.empty( vlen , dtype = bool ) )
+
+                # エッジ情報の取り出し
+                edges = snapshot.edges_idx
+                view.edgeVisible = view.vertVisible[ edges[:,0] ]
+                view.edgeVisible &= workspace.gather( 'edgeVisible' , view.vertVisible , edges[:,1] )
+
+                self.__compact( view , snapshot )
+            view.journal_cursor = snapshot.journal_serial
+
+            projections[key] = view
+            while len(projections) > snapshot.projection_cache_size :
+                projections.popitem( last = False )
+
+        self.__view = view
 
-            if self.__vertsPos is None :
-                self.__vertsPos = np.fromiter( [x for v in vts for x in v.co], dtype=np.float32, count = vlen*3).reshape((vlen, 3))
-
-            coords = np.empty((vlen, 4), dtype=np.float32 )
-            coords[:,3] = 1.0
-            coords[:,:-1] = self.__vertsPos
-
-            # ビューポート変換
-            coords = np.dot( coords , np.array( pj_matrix, dtype=np.float32 ).transpose() )
-            coords = coords[:,:-1] / coords[:,3:4]
-            coords = coords * np.array(( width / 2, height / 2,1), dtype=np.float32) +  np.array(( width / 2, height / 2,0), dtype=np.float32)
-            css = coords.reshape(vlen,3)
-
-            # エッジ情報の取り出し
-            edges = self.pqo.bm.edges
-            elen = len(edges)
-            if self.__edgesIdx is None :
-                self.__edgesIdx = np.fromiter( [v.index for e in edges for v in e.verts ], dtype=np.int32, count = elen *2)
-            eds = css[self.__edgesIdx].reshape(elen,2,3)
-
-            # 範囲内チェック
-            con = (coords[:,2] < 1.0) & ( coords[:,0] >= 0 ) & ( coords[:,0] <= width ) & (coords[:,1] >= 0) & (coords[:,1] <= height)
-
-            # 頂点出力
-            vidxs = np.where( con )
-            self.__viewPosVertsNP , self.__viewPosVertsIdx = coords[vidxs][:,:2] , vidxs[0]
-
-            # エッジ出力
-            coe = con[self.__edgesIdx].reshape(elen,2)
-            eidxs = np.where( coe[:,0] & coe[:,1] )
-            self.__viewPosEdgeNP , self.__viewPosEdgeIdx = eds[eidxs][:,:,0:2] , eidxs[0]
-
-            self.__boundaryViewPosEdges = None
-            self.__boundaryViewPosVerts = None
-
-            self.current_matrix = pj_matrix            
-
-#            elapsed_time = time.time() - start
-#            print ("__elapsed_time:{0}".format(elapsed_time) + "[sec]")            
+#        elapsed_time = time.time() - start
+#        print ("__elapsed_time:{0}".format(elapsed_time) + "[sec]")            
+
+    def occlusion_mask( self , world_positions ) :
+        """Mask of world positions not hidden by the edit mesh or snap targets in this view."""
+        view = self.view
+        if view.depth is None or view.depth.snap_token != QSnap.targets_token() :
+            view.depth = self.__build_depth( view )
+        return view.depth.test( world_positions , bpy.context.scene.tool_settings.double_threshold )
+
+    def __build_depth( self , view ) :
+        snapshot = self.pqo.snapshot
+        depth = QMeshDepth( view.perspective_matrix , view.view_matrix , view.is_perspective , view.width , view.height , self.pqo.preferences.depth_buffer_scale )
+        depth.snap_token = QSnap.targets_token()
+        matrix_world = np.array( self.pqo.obj.matrix_world )
+        world_co = snapshot.verts_co @ matrix_world[:3,:3].T + matrix_world[:3,3]
+        depth.rasterize( world_co , snapshot.triangles( self.pqo.bm ) )
+        # スナップ対象は編集メッシュを隠せる三角形だけ描く
+        depth.clip_to( world_co )
+        for co , tris in QSnap.triangles( bpy.context ) :
+            depth.rasterize( co , tris )
+        return depth
 
     def IntersectPointInSphere( point , points , radius ) :
         rt = np.sum( (points - point) ** 2 , axis = -1 )
@@ -169,81 +286,119 @@ class QMeshHighlight :
 
         return ri[0]
 
-    def CollectVerts( self , coord , radius : float , ignore = [] , edgering = False , backface_culling = True ) -> ElementItem :
+    def CollectVerts( self , coord , radius : float , ignore = [] , edgering = False , backface_culling = True , occlusion = False ) -> HoverCandidate :
         viewPosVerts , viewPosVertIdx = self.viewPosVerts
-        if edgering :
-            viewPosVerts = viewPosVerts[ self.boundaryViewPosVerts ]
-            viewPosVertIdx = viewPosVertIdx[ self.boundaryViewPosVerts ]
+        snapshot = self.pqo.snapshot_cache
 
-#        start = time.time()        
         co = np.array( coord , dtype = np.float32 )
-        verts = self.pqo.bm.verts
-
-        ri = np_math.IntersectPointInSphere( co , viewPosVerts , display.dot(radius) )
-
-        vts = [ [verts[ viewPosVertIdx[i] ] , viewPosVerts[i] ] for i in ri ]
+        radius = display.dot(radius)
 
+        # グリッドで候補を絞ってから距離判定
+        rows = self.vertGrid.query( co , radius )
         if edgering :
-            vts = [ v for v in vts if v[0].is_boundary or v[0].is_manifold == False ]
-
+            rows = rows[ snapshot.verts_ring[ viewPosVertIdx[rows] ] ]
+        rows = rows[ np_math.IntersectPointInSphere( co , viewPosVerts[rows] , radius ) ]
+        ids = viewPosVertIdx[rows]
+
+        # 非表示 , 除外 , 裏面は配列のまま落とす
+        mask = ~snapshot.verts_hide[ids]
+        if ignore :
+            mask &= ~np.isin( ids , self.__indices( ignore ) )
         if backface_culling :
             ray = pqutil.Ray.from_screen( bpy.context , coord ).world_to_object( self.pqo.obj )
-            vts = [ v for v in vts if v[0].is_manifold == False or v[0].is_boundary or v[0].normal.dot( ray.vector ) < 0 ]
-
-        vts = [ v for v in vts if not v[0].hide and v[0] not in ignore ]
-
-        vts = sorted( vts , key=lambda i: np.linalg.norm(i[1] - co) )
+            facing = snapshot.verts_no[ids] @ np.array( ray.vector , dtype = np.float32 ) < 0
+            mask &= snapshot.verts_nonmanifold[ids] | snapshot.verts_boundary[ids] | facing
+        rows = rows[mask]
+        ids = ids[mask]
+        if occlusion and len(ids) > 0 :
+            # 深度バッファで隠れている頂点を落とす
+            matrix = np.array( self.pqo.obj.matrix_world )
+            mask = self.occlusion_mask( snapshot.verts_co[ids] @ matrix[:3,:3].T + matrix[:3,3] )
+            rows = rows[mask]
+            ids = ids[mask]
+
+        order = np.argsort( np.sum( ( viewPosVerts[rows] - co ) ** 2 , axis = -1 ) , kind = 'stable' )
+        verts = self.pqo.bm.verts
         matrix_world = self.pqo.obj.matrix_world
 
-#        elapsed_time = time.time() - start
-#        print ("_elapsed_time:{0}".format(elapsed_time) + "[sec]")        
-
-        return [ ElementItem( self.pqo , v , Vector(t) , matrix_world @ v.co ) for v,t in vts ] 
+        # 候補は軽量レコードで、呼び出し側が調べた分だけ作る
+        return ( HoverCandidate( self.pqo , verts[i] , Vector( viewPosVerts[r] ) , matrix_world @ verts[i].co )
+                    for r , i in zip( rows[order].tolist() , ids[order].tolist() ) )
 
 
-    def CollectEdge( self ,coord , radius : float , ignore = [] , backface_culling = True , edgering = False ) -> ElementItem :
-        start = time.time()      
+    def CollectEdge( self ,coord , radius : float , ignore = [] , backface_culling = True , edgering = False , occlusion = False ) -> HoverCandidate :
         viewPosEdges , viewPosEdgesIdx = self.viewPosEdges
-        if edgering :
-            viewPosEdges = viewPosEdges[ self.boundaryViewPosEdges ]
-            viewPosEdgesIdx = viewPosEdgesIdx[ self.boundaryViewPosEdges ]
+        snapshot = self.pqo.snapshot_cache
 
         co = np.array( coord , dtype = np.float32 )
-        edges = self.pqo.bm.edges
-        p = Vector( coord )
         ray = pqutil.Ray.from_screen( bpy.context , coord )
-        ray_distance = ray.distance
-        location_3d_to_region_2d = pqutil.location_3d_to_region_2d
-        matrix_world = self.pqo.obj.matrix_world      
-
-        hit = np_math.DistancePointToLine2D( co , viewPosEdges , display.dot(radius) )
-
-        hit = [ edges[h] for h in viewPosEdgesIdx[ hit ] ]
-
-        def Conv( edge ) -> ElementItem :
-            v1 = matrix_world @ edge.verts[0].co
-            v2 = matrix_world @ edge.verts[1].co
-            h0 , h1 , d = ray_distance( pqutil.Ray( v1 , (v1-v2) ) )
-            c = location_3d_to_region_2d(h1)
-            return ElementItem( self.pqo , edge , c , h1 , d )
-
-        if edgering :        
-            r = [ Conv(e) for e in hit if not e.hide and len(e.link_faces) <= 1 and e not in ignore ]
-        else :
-            r = [ Conv(e) for e in hit if not e.hide and e not in ignore ]
 
+        radius = display.dot(radius)
+        rows = self.edgeGrid.query( co , radius )
+        if edgering :
+            rows = rows[ snapshot.edges_ring[ viewPosEdgesIdx[rows] ] ]
+        if len(rows) > 0 :
+            rows = rows[ np_math.DistancePointToLine2D( co , viewPosEdges[rows] , radius ) ]
+        ids = viewPosEdgesIdx[ rows ]
+
+        mask = ~snapshot.edges_hide[ids]
+        if ignore :
+            mask &= ~np.isin( ids , self.__indices( ignore ) )
         if backface_culling :
-            ray2 = ray.world_to_object( self.pqo.obj )
-            r = [ i for i in r
-                if not i.element.is_manifold or i.element.is_boundary or
-                    i.element.verts[0].normal.dot( ray.vector ) < 0 or i.element.verts[1].normal.dot( ray2.vector ) < 0 ]
-        
-        s = sorted( r , key=lambda i:(i.coord - p).length_squared )
+            vector = np.array( ray.world_to_object( self.pqo.obj ).vector , dtype = np.float32 )
+            ev = snapshot.edges_idx[ids]
+            mask &= ( snapshot.edges_faces[ids] != 2 ) | ( snapshot.verts_no[ ev[:,0] ] @ vector < 0 ) | ( snapshot.verts_no[ ev[:,1] ] @ vector < 0 )
 
-#        elapsed_time = time.time() - start
-#        print ("_elapsed_time:{0}".format(elapsed_time) + "[sec]")        
+        edges = self.pqo.bm.edges
+        hit = [ edges[i] for i in ids[mask].tolist() ]
+        coords , hits , dists = self.__ray_to_edges( ray , hit )
+        if occlusion and len(hit) > 0 :
+            mask = self.occlusion_mask( hits )
+            hit = [ e for e , m in zip( hit , mask.tolist() ) if m ]
+            coords , hits , dists = coords[mask] , hits[mask] , dists[mask]
+        order = np.argsort( np.sum( ( coords - co ) ** 2 , axis = -1 ) , kind = 'stable' )
+
+        return ( HoverCandidate( self.pqo , hit[i] , Vector( coords[i] ) , Vector( hits[i] ) , float( dists[i] ) )
+                    for i in order.tolist() )
+
+    def __ray_to_edges( self , ray , edges ) :
+        # Ray.distance と location_3d_to_region_2d を候補の辺でまとめて計算
+        if not edges :
+            return np.empty( (0,2) ) , np.empty( (0,3) ) , np.empty( 0 )
+        matrix_world = np.array( self.pqo.obj.matrix_world )
+        local = np.array( [ v.co for e in edges for v in e.verts ] )
+        world = local @ matrix_world[:3,:3].T + matrix_world[:3,3]
+        v1 = world[0::2]
+        v2 = world[1::2]
+
+        a = np.array( ray.vector )
+        b = v1 - v2
+        b /= np.maximum( np.linalg.norm( b , axis = -1 ) , 1e-12 )[:,None]
+        w = v1 - np.array( ray.origin )
+        Dv = b @ a
+        D1 = w @ a
+        D2 = np.sum( w * b , axis = -1 )
+        denom = Dv * Dv - 1.0
+        # 平行な辺は始点を採用
+        parallel = denom > -0.000001
+        denom[parallel] = -1.0
+        t1 = ( D1 - D2 * Dv ) / -denom
+        t2 = ( D2 - D1 * Dv ) / denom
+        t2[parallel] = 0.0
+        t1[parallel] = D1[parallel]
+        hits = v1 + b * t2[:,None]
+        dists = np.linalg.norm( hits - ( np.array( ray.origin ) + a * t1[:,None] ) , axis = -1 )
+
+        region = bpy.context.region
+        matrix = np.array( bpy.context.region_data.perspective_matrix )
+        prj = hits @ matrix[:,:3].T + matrix[:,3]
+        half = np.array( ( region.width / 2.0 , region.height / 2.0 ) )
+        coords = half + half * prj[:,:2] / prj[:,3:4]
+        return coords , hits , dists
 
-        return s
+    @staticmethod
+    def __indices( elements ) :
+        return np.fromiter( ( e.index for e in elements if e.is_valid ) , dtype = np.int64 )
 
     def PickFace( self ,coord , ignore = []  , backface_culling = True ) -> ElementItem :
         ray = pqutil.Ray.from_screen( bpy.context , coord ).world_to_object( self.pqo.obj )
@@ -268,18 +423,15 @@ class QMeshHighlight :
     def find_quad2( self , coord ) :
         co = np.array( coord , dtype = np.float32 )   
         verts = self.pqo.bm.verts
-        vpos = self.__viewPosVertsNP[ self.boundaryViewPosVerts ]
-        vids = self.__viewPosVertsIdx[ self.boundaryViewPosVerts ]
-        epos = self.__viewPosEdgeNP[ self.boundaryViewPosEdges ]
-        eids = self.__viewPosEdgeIdx[ self.boundaryViewPosEdges ]
+        boundaryVerts = self.boundaryViewPosVerts
+        view = self.view
+        vpos = view.viewPosVerts[ boundaryVerts ]
+        vids = view.viewPosVertsIdx[ boundaryVerts ]
+        edges_ring = self.pqo.snapshot_cache.edges_ring
         matrix = self.pqo.obj.matrix_world
 
-        st = np.argsort( np.linalg.norm( vpos - co , axis=-1 ) )
-
-        T = np.array([[0, -1], [1, 0]])
-
-        l0 = epos[:,0]
-        l1 = epos[:,1]
+        dist = np.linalg.norm( vpos - co , axis=-1 )
+        st = np.argsort( dist )
 
         def convex_hull( points ) :
             idxs = mathutils.geometry.convex_hull_2d( points )
@@ -289,56 +441,38 @@ class QMeshHighlight :
                 return [ i for r,i in angles ]
             return idxs
 
-        def Check( vp ) :
-            da = np.atleast_2d( vp - co )
-            db = np.atleast_2d( l1 - l0 )
-            dp = np.atleast_2d( co - l0 )
-
-            dap = np.dot( da , T )
-            denom = np.sum(dap * db, axis=1)
-            num = np.sum(dap * dp, axis=1)
-            t = np.atleast_2d(num / denom).T * db + l1
-
-            d = np.linalg.norm( l0 - l1, axis=-1  )
-
-            dist = np.linalg.norm( vp - co, axis=-1 )
-#            g = ( np.linalg.norm( co - t, axis=-1 ) < dist ) & (np.linalg.norm(l0 - t, axis=-1 ) > d) & ( np.linalg.norm(l1 - t, axis=-1 ) > d )
-            g = ( np.linalg.norm( co - t, axis=-1 ) < dist )
-
-            hits = t[g]
-            hits = hits[ np.argsort( np.linalg.norm( hits - co , axis=-1 ) ) ]
-            return hits
-
-        def Check2( vp ) :
-            for l in epos :
-                hit = mathutils.geometry.intersect_line_line_2d( co , vp , l[0], l[1] )
-                if hit != None and (hit - Vector(vp) ).length > 0.001 :
-                    return True
-            return False
+        def Occluded( chunk ) :
+            # co から各候補への線分と近くの境界エッジを一括で交差判定
+            rows = self.edgeGrid.query( co , float( dist[chunk].max() ) )
+            rows = rows[ edges_ring[ view.viewPosEdgeIdx[rows] ] ]
+            if len(rows) == 0 :
+                return np.zeros( len(chunk) , dtype = bool )
+            lines = np.empty( ( len(chunk) , 2 , 2 ) , dtype = np.float32 )
+            lines[:,0] = co
+            lines[:,1] = vpos[chunk]
+            u , hit = np_math.IntersectLines2DLines2D( lines , view.viewPosEdges[rows] )
+            # 候補頂点そのものでの交差は除く
+            hit &= ( 1.0 - u ) * dist[chunk][:,None] > 0.001
+            return np.any( hit , axis = 1 )
 
         geom = []
-        for s in st :
-            vi = vids[s]
-            vo = verts[vi]
+        for start in range( 0 , len(st) , self.find_quad_batch ) :
+            chunk = st[ start : start + self.find_quad_batch ]
+            chunk = chunk[ ~Occluded( chunk ) ]
 
             # オブジェクト表面か？
-            if not QSnap.is_target( matrix @ vo.co ) :       
-                continue
+            targets = QSnap.is_targets( [ matrix @ verts[vi].co for vi in vids[chunk].tolist() ] )
+            for s , is_target in zip( chunk.tolist() , targets ) :
+                if not is_target :
+                    continue
 
-            vp = vpos[s]
-            line = np.array( (co,vp) ).reshape( 2,2 )
+                geom.append( ( verts[ vids[s] ] , vpos[s] ) )
 
-            #ライン交差
-            if Check2(vp) :
-                continue
+                if len(geom) >= 3 :
+                    geom = [ geom[i] for i in convex_hull( [ p for v,p in geom ] ) ]
 
-            geom.append( (vo,vp) )
-
-            if len(geom) >= 3 :
-                geom = [ geom[i] for i in convex_hull( [ p for v,p in geom ] ) ]
-
-            if( len(geom) >= 4 ) :
-                break
+                if( len(geom) >= 4 ) :
+                    return [ v for v,p in geom]
                 
         return [ v for v,p in geom]
 
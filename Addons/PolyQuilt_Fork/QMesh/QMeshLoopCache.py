@@ -0,0 +1,46 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['QMeshLoopCache']
+
+class QMeshLoopCache :
+    """
+    Edge loops / rings keyed by ( kind , edge index , topology version , mirror ).
+    One per edited mesh, cleared by QMesh.UpdateMesh.
+    """
+    hits = 0
+    misses = 0
+
+    def __init__(self) :
+        self.__table = {}
+
+    def get( self , key , calc ) :
+        ret = self.__table.get(key)
+        # UpdateMesh を通らずに消された要素が混ざっていたら作り直す
+        if ret is not None and all( e.is_valid for e in ret ) :
+            QMeshLoopCache.hits = QMeshLoopCache.hits + 1
+            return ret
+        QMeshLoopCache.misses = QMeshLoopCache.misses + 1
+        ret = calc()
+        self.__table[key] = ret
+        return ret
+
+    def clear( self ) :
+        self.__table.clear()
+
+    def __len__( self ) :
+        return len(self.__table)
+
+    @classmethod
+    def stats( cls ) :
+        return cls.hits , cls.misses
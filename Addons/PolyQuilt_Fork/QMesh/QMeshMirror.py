@@ -0,0 +1,166 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from ..utils import np_math
+
+__all__ = ['QMeshMirror']
+
+class QMeshMirror :
+    """
+    X mirror correspondence of the snapshot's vertices, edges and faces (-1 = none).
+    Built in one vectorised pass per topology version; moved vertices are patched
+    in place. Vertices with several candidates within the threshold are flagged
+    ambiguous and left to the geometric search in QMeshOperators.find_mirror.
+    """
+    # 動いた頂点がこの割合を超えたらグリッドを作り直す
+    rebuild_fraction = 0.1
+    __offsets = np.stack( np.meshgrid( *( np.arange(-1,2) , ) * 3 , indexing = 'ij' ) , axis = -1 ).reshape(-1,3)
+
+    def __init__( self , snapshot , threshold ) :
+        self.threshold = threshold
+        self.topology_version = snapshot.topology_version
+        self.__snapshot = snapshot
+        vlen = len(snapshot.verts_co)
+        self.verts = np.full( vlen , -1 , dtype = np.int32 )
+        self.ambiguous = np.zeros( vlen , dtype = bool )
+        self.__faces = None
+
+        self.__build_grid( snapshot.verts_co )
+        self.__match_verts( np.arange( vlen ) )
+
+        edges = snapshot.edges_idx.astype( np.int64 )
+        keys = self.__edge_key( edges )
+        self.__edge_order = np.argsort( keys , kind = 'stable' )
+        self.__edge_sorted = keys[self.__edge_order]
+        self.edges = np.full( len(edges) , -1 , dtype = np.int32 )
+        self.__match_edges( np.arange( len(edges) ) )
+
+    @property
+    def faces( self ) :
+        # 面は使われた時に作る
+        if self.__faces is None :
+            self.__faces = self.__match_faces()
+        return self.__faces
+
+    def patch( self , ids ) :
+        """Refresh the rows touched by moving vertices ids."""
+        if len(ids) == 0 :
+            return
+        snapshot = self.__snapshot
+        self.__move( ids )
+        old = self.verts[ids]
+        affected = np.union1d( ids , old[ old >= 0 ] )
+        self.__match_verts( affected )
+        # 新しく相手になった頂点も相手を付け直す
+        new = self.verts[affected]
+        partners = np.setdiff1d( new[ new >= 0 ] , affected )
+        if len(partners) :
+            self.__match_verts( partners )
+            affected = np.union1d( affected , partners )
+        self.__match_edges( snapshot.vert_edges( affected ) )
+        self.__faces = None
+
+    def __build_grid( self , co ) :
+        self.__cell = max( self.threshold , 1e-9 )
+        # 衝突しても距離で弾くので大丈夫
+        keys = np_math.spatial_hash( np.floor( co / self.__cell ).astype( np.int64 ) )
+        self.__grid_order = np.argsort( keys , kind = 'stable' )
+        self.__grid_sorted = keys[self.__grid_order]
+        # グリッドの位置が古くなった行と , それだけを入れた小さなグリッド
+        self.__stale = np.zeros( len(co) , dtype = bool )
+        self.__extra = np.empty( 0 , dtype = np.int64 )
+        self.__extra_order = self.__extra
+        self.__extra_sorted = self.__extra
+
+    def __move( self , ids ) :
+        co = self.__snapshot.verts_co
+        self.__extra = np.union1d( self.__extra , np.asarray( ids , dtype = np.int64 ) )
+        if len(self.__extra) > self.rebuild_fraction * max( len(co) , 1 ) :
+            self.__build_grid( co )
+            return
+        self.__stale[self.__extra] = True
+        keys = np_math.spatial_hash( np.floor( co[self.__extra] / self.__cell ).astype( np.int64 ) )
+        order = np.argsort( keys , kind = 'stable' )
+        self.__extra_order = self.__extra[order]
+        self.__extra_sorted = keys[order]
+
+    @staticmethod
+    def __probe( sorted_keys , order , keys ) :
+        # keys (m,k) -> ( 問い合わせ行 , 頂点 )
+        lo = np.searchsorted( sorted_keys , keys , side = 'left' ).reshape(-1)
+        hi = np.searchsorted( sorted_keys , keys , side = 'right' ).reshape(-1)
+        counts = hi - lo
+        q = np.repeat( np.arange( keys.shape[0] ).repeat( keys.shape[1] ) , counts )
+        return q , order[ np_math.csr_gather( lo , counts ) ]
+
+    def __match_verts( self , ids ) :
+        co = self.__snapshot.verts_co
+        targets = co[ids] * ( -1.0 , 1.0 , 1.0 )
+        cells = np.floor( targets / self.__cell ).astype( np.int64 )
+        keys = np_math.spatial_hash( cells[:,None,:] + self.__offsets[None,:,:] )
+        q , v = self.__probe( self.__grid_sorted , self.__grid_order , keys )
+        fresh = ~self.__stale[v]
+        q , v = q[fresh] , v[fresh]
+        if len(self.__extra) :
+            q1 , v1 = self.__probe( self.__extra_sorted , self.__extra_order , keys )
+            q , v = np.concatenate( ( q , q1 ) ) , np.concatenate( ( v , v1 ) )
+        # ハッシュの衝突で同じ組が重複する
+        pair = np.unique( q.astype( np.int64 ) * len(co) + v )
+        q , v = pair // len(co) , pair % len(co)
+        d = np.linalg.norm( co[v] - targets[q] , axis = 1 )
+        keep = d <= self.threshold
+        q , v , d = q[keep] , v[keep] , d[keep]
+
+        result = np.full( len(ids) , -1 , dtype = np.int32 )
+        order = np.lexsort( ( d , q ) )
+        q , v = q[order] , v[order]
+        first = np.ones( len(q) , dtype = bool )
+        first[1:] = q[1:] != q[:-1]
+        result[ q[first] ] = v[first]
+        self.verts[ids] = result
+        self.ambiguous[ids] = np.bincount( q , minlength = len(ids) ) > 1
+
+    def __edge_key( self , pairs ) :
+        vlen = len(self.verts)
+        return np.minimum( pairs[:,0] , pairs[:,1] ) * vlen + np.maximum( pairs[:,0] , pairs[:,1] )
+
+    def __match_edges( self , eids ) :
+        if len(eids) == 0 :
+            return
+        mirror = self.verts[ self.__snapshot.edges_idx[eids] ].astype( np.int64 )
+        ok = np.all( mirror >= 0 , axis = 1 )
+        self.edges[eids] = self.__lookup( self.__edge_sorted , self.__edge_order , self.__edge_key( mirror ) , ok )
+
+    @staticmethod
+    def __lookup( sorted_keys , order , keys , ok ) :
+        result = np.full( len(keys) , -1 , dtype = np.int32 )
+        if len(sorted_keys) == 0 :
+            return result
+        pos = np.minimum( np.searchsorted( sorted_keys , keys ) , len(sorted_keys) - 1 )
+        found = ok & ( sorted_keys[pos] == keys )
+        result[found] = order[ pos[found] ]
+        return result
+
+    def __match_faces( self ) :
+        snapshot = self.__snapshot
+        starts = snapshot.faces_loop_start
+        result = np.full( len(starts) , -1 , dtype = np.int32 )
+        if len(starts) == 0 :
+            return result
+        mirror = self.verts[ snapshot.loops_vert ].astype( np.int64 )
+        ok = np.logical_and.reduceat( mirror >= 0 , starts )
+        # 頂点の集合で比べる
+        found = snapshot.find_faces( np.maximum( mirror , 0 ) , starts )
+        result[ok] = found[ok]
+        return result
@@ -19,10 +19,12 @@ import mathutils
 import bpy_extras
 import collections
 import time
+import numpy as np
 from mathutils import *
 from ..utils import pqutil
 from ..utils import draw_util
 from .ElementItem import *
+from .QMeshSnapshot import QMeshSnapshot
 from ..utils.dpi import *
 
 class QMeshOperators :
@@ -31,13 +33,11 @@ class QMeshOperators :
         self.mesh = obj.data
         self.bm = bmesh.from_edit_mesh(self.mesh)
         self.current_matrix = None
-        self.__btree = None
-        self.__kdtree = None
+        self.__snapshot = QMeshSnapshot.shared( self.mesh , self.bm )
         self.preferences = preferences
         
     def __del__(self) :
-        del self.__btree
-        del self.__kdtree
+        del self.__snapshot
 
     def _CheckValid( self , context ) :
         active_obj = context.active_object
@@ -61,6 +61,7 @@ class QMeshOperators :
             self.mesh = self.obj.data
             self.bm = bmesh.from_edit_mesh(self.mesh)
             self.ensure_lookup_table()
+            self.__snapshot = QMeshSnapshot.shared( self.mesh , self.bm )
         else :
             self.mesh = None
             self.bm = None
@@ -68,15 +69,10 @@ class QMeshOperators :
         self.reload_tree()            
 
     def reload_tree( self ) :
-        if self.__btree :
-            del self.__btree
-            self.__btree = None
-        if self.__kdtree :
-            del self.__kdtree
-            self.__kdtree = None
+        self.__snapshot.invalidate()
 
 
-    def UpdateMesh( self , changeTopology = True , loop_triangles = True,destructive = True ) :
+    def UpdateMesh( self , changeTopology = True , loop_triangles = True,destructive = True , moved_verts = None ) :
         self.bm.normal_update()
         self.ensure_lookup_table()
         self.obj.data.update_gpu_tag()
@@ -84,26 +80,34 @@ class QMeshOperators :
         self.obj.update_tag()
         bmesh.update_edit_mesh(self.obj.data , loop_triangles = loop_triangles,destructive = destructive )
 #       self.obj.update_from_editmode()
+        if moved_verts is not None and not changeTopology :
+            # 移動した頂点だけ記録して差分更新させる
+            self.__snapshot.mark_moved( self.bm , moved_verts )
+        else :
+            self.__snapshot.invalidate( changeTopology )
         if changeTopology :
-            self.__btree = None
-            self.__kdtree = None
             self.current_matrix = None    
 
     @property
     def btree(self):
-        if self.__btree == None :
-            self.__btree = bvhtree.BVHTree.FromBMesh(self.bm)
-        return self.__btree
+        if self.__snapshot.btree == None :
+            self.__snapshot.btree = bvhtree.BVHTree.FromBMesh(self.bm)
+        return self.__snapshot.btree
+
+    @property
+    def snapshot(self) -> QMeshSnapshot :
+        return self.__snapshot.update(self.bm)
+
+    @property
+    def snapshot_cache(self) -> QMeshSnapshot :
+        # バージョン確認用(更新しない)
+        return self.__snapshot
 
     @property
     def kdtree(self):
-        if self.__kdtree == None :
-            size = len(self.bm.verts)
-            self.__kdtree = mathutils.kdtree.KDTree(size)
-            for i, v in enumerate(self.bm.verts):
-                self.__kdtree.insert(v.co, i)
-            self.__kdtree.balance()
-        return self.__kdtree
+        # mathutils.kdtree.KDTree と同じ find / find_range が使える
+        cell = bpy.context.scene.tool_settings.double_threshold * 2
+        return self.snapshot.point_index( cell )
 
     @property
     def verts(self): 
@@ -149,6 +153,19 @@ class QMeshOperators :
     def local_to_2d(  self ,pos : Vector ) :
         return pqutil.location_3d_to_region_2d( self.obj.matrix_world @ pos )
 
+    @staticmethod
+    def find_face( verts ) :
+        # 全ての面ではなく 頂点に繋がる面の共通部分から探す
+        verts = [ v for v in verts if v is not None and v.is_valid ]
+        if not verts :
+            return None
+        vset = set(verts)
+        fewest = min( verts , key = lambda v : len(v.link_faces) )
+        for f in fewest.link_faces :
+            if len(f.verts) == len(vset) and all( v in vset for v in f.verts ) :
+                return f
+        return None
+
     @staticmethod
     def mirror_pos( pos : Vector ) :
         return Vector( (-pos[0],pos[1],pos[2]) )
@@ -237,15 +254,7 @@ class QMeshOperators :
             face = self.bm.faces.new( verts )
         except ValueError:
             # face already exists: find and reuse it
-            face = None
-            vset = set(verts)
-            for f in self.bm.faces:
-                try:
-                    if set(f.verts) == vset:
-                        face = f
-                        break
-                except Exception:
-                    continue
+            face = self.find_face( verts )
         if face is None :
             return None
 
@@ -362,20 +371,21 @@ class QMeshOperators :
             verts[ e.verts[0] ] = e.is_wire
             verts[ e.verts[1] ] = e.is_wire
 
-        for edge in edges :
-            if edge.is_valid :
-                if edge.is_boundary :
-                    bmesh.ops.delete( self.bm , geom = [edge] , context = 'EDGES' )
-                elif edge.is_wire :
-                    bmesh.ops.delete( self.bm , geom = [edge] , context = 'EDGES' )
-                else :
-                    bmesh.ops.dissolve_edges( self.bm , edges = [edge] , use_verts = use_verts , use_face_split = use_face_split )
+        # 種類ごとにまとめて1回で処理する
+        # 消した辺の隣が境界になったら次の回で消す
+        edges = [ e for e in edges if e.is_valid ]
+        while edges :
+            deletes = [ e for e in edges if e.is_boundary or e.is_wire ]
+            if not deletes :
+                bmesh.ops.dissolve_edges( self.bm , edges = edges , use_verts = use_verts , use_face_split = use_face_split )
+                break
+            bmesh.ops.delete( self.bm , geom = deletes , context = 'EDGES' )
+            edges = [ e for e in edges if e.is_valid ]
 
         # 独立頂点を削除
-        delete_Verts = [ v for v , w in verts.items() if v.is_valid and len(v.link_edges) == 0 ]
-        bmesh.ops.delete( self.bm , geom = delete_Verts , context = 'VERTS' )
-        delete_Verts = [ v for v , w in verts.items() if v.is_valid and len(v.link_edges) == 1 and not w ]
-        bmesh.ops.delete( self.bm , geom = delete_Verts , context = 'VERTS' )
+        delete_Verts = [ v for v , w in verts.items() if v.is_valid and ( len(v.link_edges) == 0 or ( len(v.link_edges) == 1 and not w ) ) ]
+        if delete_Verts :
+            bmesh.ops.delete( self.bm , geom = delete_Verts , context = 'VERTS' )
 
         dissolve_verts = [ v for v in verts if v.is_valid ]
 
@@ -385,19 +395,26 @@ class QMeshOperators :
             bmesh.ops.dissolve_verts( self.bm , verts  = dissolve_verts , use_face_split = use_face_split , use_boundary_tear = False  )
 
     def calc_limit_verts( self , verts , dissolve_vert_angle  = 180 , is_mirror = None ) :
+        verts = [ v for v in verts if v.is_valid and len(v.link_edges) == 2 ]
+        if not verts :
+            return []
+        co = np.array( [ v.co for v in verts ] , dtype = np.float64 )
+        n0 = np.array( [ v.link_edges[0].other_vert(v).co for v in verts ] , dtype = np.float64 ) - co
+        n1 = np.array( [ v.link_edges[1].other_vert(v).co for v in verts ] , dtype = np.float64 ) - co
+        l0 = np.linalg.norm( n0 , axis = 1 )
+        l1 = np.linalg.norm( n1 , axis = 1 )
+        # 長さ0は Vector.normalized() と同じく0ベクトル扱い
+        dot = np.einsum( 'ij,ij->i' , n0 , n1 ) / np.where( l0 * l1 > 0 , l0 * l1 , np.inf )
+        r = np.ceil( np.degrees( np.arccos( np.clip( dot , -1 , 1 ) ) ) )
+
         removes = set()
-        for vert in [ v for v in verts if v.is_valid and len(v.link_edges) == 2 ] :
-            n0 = (vert.link_edges[0].other_vert(vert).co - vert.co).normalized()
-            n1 = (vert.link_edges[1].other_vert(vert).co - vert.co).normalized()
-            r = max( min( n0.dot(n1) , 1 ) , -1 )
-            r = math.acos(r)
-            r = math.ceil(math.degrees(r))
-            if r > dissolve_vert_angle :
-                removes.add(vert)
-                if self.check_mirror(is_mirror) :
-                    mirror = self.find_mirror( vert )
-                    if mirror != None :
-                        removes.add(mirror)                
+        for i in np.flatnonzero( r > dissolve_vert_angle ).tolist() :
+            vert = verts[i]
+            removes.add(vert)
+            if self.check_mirror(is_mirror) :
+                mirror = self.find_mirror( vert )
+                if mirror != None :
+                    removes.add(mirror)                
         return list(removes)
 
 
@@ -482,6 +499,63 @@ class QMeshOperators :
 
 
     def find_mirror( self , geom , check_same = True ) :
+        dist = bpy.context.scene.tool_settings.double_threshold
+        mirror = self.snapshot.mirror_map( dist )
+        if isinstance( geom , bmesh.types.BMVert ) :
+            table , seq = mirror.verts , self.bm.verts
+        elif isinstance( geom , bmesh.types.BMEdge ) :
+            table , seq = mirror.edges , self.bm.edges
+        elif isinstance( geom , bmesh.types.BMFace ) :
+            table , seq = mirror.faces , self.bm.faces
+        else :
+            return None
+
+        i = geom.index
+        if self.__is_mapped( seq , geom , len(table) ) and not ( isinstance( geom , bmesh.types.BMVert ) and mirror.ambiguous[i] ) :
+            j = int( table[i] )
+            if j >= 0 :
+                result = self.__mapped( seq , j )
+                # 編集途中でマップが古い時は探し直す
+                if result is None or not self.test_mirror_geom( geom , result ) :
+                    result = self.__search_mirror( geom )
+            elif isinstance( geom , bmesh.types.BMVert ) and self.__is_current( geom ) :
+                # 今の位置で作ったマップで相手が無いなら本当に無い
+                result = None
+            else :
+                # 辺と面は頂点の対応が揃わないと載らないので探し直す
+                result = self.__search_mirror( geom )
+        else :
+            result = self.__search_mirror( geom )
+
+        if check_same and result is not None and result.index == geom.index :
+            return None
+
+        return result
+
+    def __is_current( self , vert ) :
+        co = self.snapshot.verts_co[vert.index]
+        return co[0] == vert.co[0] and co[1] == vert.co[1] and co[2] == vert.co[2]
+
+    @staticmethod
+    def __mapped( seq , i ) :
+        try :
+            return seq[i]
+        except IndexError :
+            return None
+
+    @staticmethod
+    def __is_mapped( seq , geom , size ) :
+        # UpdateMesh 前に作られた要素はマップに無い
+        i = geom.index
+        if i < 0 or i >= size :
+            return False
+        try :
+            return seq[i] == geom
+        except IndexError :
+            return False
+
+    def __search_mirror( self , geom ) :
+        # 距離と隣接要素の形で探す (ミラーマップに載っていない要素用)
         result = None
         dist = bpy.context.scene.tool_settings.double_threshold
 
@@ -520,9 +594,6 @@ class QMeshOperators :
                         continue
                     break
 
-        if check_same and result is not None and result.index == geom.index :
-            return None
-
         return result
 
     def find_near( self , pos : mathutils.Vector , is_mirror = None ) :
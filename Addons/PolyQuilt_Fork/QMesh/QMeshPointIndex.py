@@ -0,0 +1,125 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+import mathutils
+from ..utils import np_math
+
+__all__ = ['QMeshPointIndex']
+
+class QMeshPointIndex :
+    """
+    Hashed uniform grid over the snapshot vertices, with the find / find_range
+    interface of mathutils.kdtree.KDTree.
+    Moved, added and removed vertices are kept aside until they exceed
+    rebuild_fraction of all points; then the grid is rebuilt from the array.
+    """
+    rebuild_fraction = 0.1
+    # これより多くのセルを見る半径なら全点を調べる
+    max_cells = 125
+
+    def __init__( self , co , cell ) :
+        self.cell = max( cell , 1e-9 )
+        self.rebuilds = 0
+        self.__rebuild( co )
+
+    def __len__( self ) :
+        return len(self.co)
+
+    @property
+    def pending( self ) -> int :
+        return len(self.__extra)
+
+    def __rebuild( self , co ) :
+        self.co = np.array( co , dtype = np.float32 ).reshape(-1,3)
+        keys = np_math.spatial_hash( np.floor( self.co / self.cell ).astype( np.int64 ) )
+        self.__order = np.argsort( keys , kind = 'stable' )
+        self.__sorted = keys[self.__order]
+        # グリッドの位置が古くなった行
+        self.__stale = np.zeros( len(self.co) , dtype = bool )
+        # グリッドに無いので総当たりで調べる行
+        self.__extra = set()
+        self.rebuilds = self.rebuilds + 1
+
+    def __over( self , changes ) :
+        return changes > self.rebuild_fraction * max( len(self.co) , 1 )
+
+    def update( self , ids , co ) :
+        """Move the points ids to co."""
+        ids = np.asarray( ids , dtype = np.int64 ).reshape(-1)
+        if len(ids) == 0 :
+            return
+        self.co[ids] = co
+        self.__stale[ ids[ ids < len(self.__stale) ] ] = True
+        self.__extra.update( ids.tolist() )
+        if self.__over( len(self.__extra) ) :
+            self.__rebuild( self.co )
+
+    def sync( self , co ) :
+        """Bring the index in line with co ; appended and removed tail rows are handled incrementally."""
+        co = np.asarray( co ).reshape(-1,3)
+        old = len(self.co)
+        n = len(co)
+        m = min( old , n )
+        changed = np.flatnonzero( np.any( self.co[:m] != co[:m] , axis = 1 ) )
+        if self.__over( len(self.__extra) + len(changed) + abs( n - old ) ) :
+            self.__rebuild( co )
+            return
+        if n < old :
+            self.co = self.co[:n].copy()
+            self.__extra = { i for i in self.__extra if i < n }
+        elif n > old :
+            self.co = np.concatenate( ( self.co , np.asarray( co[old:] , dtype = np.float32 ) ) )
+            self.__extra.update( range( old , n ) )
+        if len(changed) :
+            self.update( changed , co[changed] )
+
+    def __candidates( self , p , radius ) :
+        k = int( np.ceil( radius / self.cell ) )
+        if ( 2 * k + 1 ) ** 3 > self.max_cells :
+            return np.arange( len(self.co) )
+        r = np.arange( -k , k + 1 )
+        cells = np.stack( np.meshgrid( r , r , r , indexing = 'ij' ) , axis = -1 ).reshape(-1,3) + np.floor( p / self.cell ).astype( np.int64 )
+        keys = np_math.spatial_hash( cells )
+        lo = np.searchsorted( self.__sorted , keys , side = 'left' )
+        hi = np.searchsorted( self.__sorted , keys , side = 'right' )
+        idx = self.__order[ np_math.csr_gather( lo , hi - lo ) ]
+        idx = idx[ idx < len(self.co) ]
+        idx = idx[ ~self.__stale[idx] ]
+        if self.__extra :
+            idx = np.concatenate( ( idx , np.fromiter( self.__extra , dtype = np.int64 , count = len(self.__extra) ) ) )
+        # ハッシュの衝突で重複する
+        return np.unique( idx )
+
+    def find_range( self , co , radius ) :
+        """[ ( co , index , distance ) ] within radius , nearest first."""
+        p = np.array( ( co[0] , co[1] , co[2] ) , dtype = np.float64 )
+        idx = self.__candidates( p , radius )
+        if len(idx) == 0 :
+            return []
+        d = np.linalg.norm( self.co[idx] - p , axis = 1 )
+        keep = np.flatnonzero( d <= radius )
+        keep = keep[ np.argsort( d[keep] , kind = 'stable' ) ]
+        return [ ( mathutils.Vector( self.co[i] ) , i , float(dist) ) for i , dist in zip( idx[keep].tolist() , d[keep].tolist() ) ]
+
+    def find( self , co ) :
+        """Nearest point as ( co , index , distance ) , or ( None , None , None ) when empty."""
+        hits = self.find_range( co , self.cell )
+        if hits :
+            return hits[0]
+        if len(self.co) == 0 :
+            return None , None , None
+        p = np.array( ( co[0] , co[1] , co[2] ) , dtype = np.float64 )
+        d = np.linalg.norm( self.co - p , axis = 1 )
+        i = int( np.argmin(d) )
+        return mathutils.Vector( self.co[i] ) , i , float( d[i] )
@@ -0,0 +1,360 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import bpy
+import bmesh
+import collections
+import weakref
+import numpy as np
+from .QMeshLoopCache import QMeshLoopCache
+from .QMeshMirror import QMeshMirror
+from .QMeshPointIndex import QMeshPointIndex
+from ..utils import np_math
+
+__all__ = ['QMeshSnapshot']
+
+class QMeshSnapshot :
+    """
+    Flat NumPy copy of the edit bmesh topology.
+    Shared by the highlight cache, point index and mirror lookups so the
+    bmesh is walked once per topology change instead of once per user.
+    One instance per edited mesh is shared by every viewport's QMesh.
+    """
+    scratch_name = ".PolyQuilt_Snapshot"
+    journal_size = 64
+    projection_cache_size = 4
+    # matches() で位置を比べる頂点の数
+    match_samples = 64
+    __shared = weakref.WeakValueDictionary()
+
+    @classmethod
+    def shared( cls , mesh , bm ) :
+        key = mesh.as_pointer()
+        snapshot = cls.__shared.get(key)
+        if snapshot is None or snapshot.bm is not bm :
+            snapshot = cls()
+            snapshot.bm = bm
+            cls.__shared[key] = snapshot
+        return snapshot
+
+    def __init__(self) :
+        self.bm = None
+        self.btree = None
+        # 頂点の近傍検索 , 作り直さずに差分で追従する
+        self.points = None
+        # ビューごとの投影結果 (region , 行列) -> QMeshProjection
+        self.projections = collections.OrderedDict()
+        self.loop_cache = QMeshLoopCache()
+        self.mirror = None
+        self.__buffers = np_math.BufferPool()
+        self.__vert_edges = None
+        self.__tris = None
+        self.__face_keys = None
+        self.topology_version = 0
+        self.verts_co = None
+        self.verts_no = None
+        self.edges_idx = None
+        self.verts_hide = None
+        self.edges_hide = None
+        self.edges_faces = None
+        self.faces_loop_start = None
+        self.loops_vert = None
+        self.is_valid = False
+        self.is_positions_valid = False
+        self.journal = collections.deque()
+        self.journal_serial = 0
+
+    def __del__(self) :
+        self.__buffers.clear()
+        self.projections.clear()
+
+    def buffer( self , name , shape , dtype ) :
+        # 容量が足りる限り同じメモリを使い回す
+        return self.__buffers.buffer( name , shape , dtype )
+
+    def invalidate( self , changeTopology = True ) :
+        if changeTopology :
+            self.is_valid = False
+            self.topology_version = self.topology_version + 1
+            self.__vert_edges = None
+            self.__tris = None
+            self.__face_keys = None
+            self.btree = None
+            self.projections.clear()
+        self.is_positions_valid = False
+        self.loop_cache.clear()
+        self.mirror = None
+        # 記録していない変更なので古いカーソルは全部無効
+        self.journal.clear()
+        self.journal_serial = self.journal_serial + 1
+
+    def mark_moved( self , bm , verts ) :
+        """Patch the rows of moved vertices and record them in the journal."""
+        self.btree = None
+        # ミラー側のループは位置で決まる
+        self.loop_cache.clear()
+        if not ( self.is_valid and self.is_positions_valid ) :
+            self.mirror = None
+            return
+        ids = np.fromiter( ( v.index for v in verts if v is not None and v.is_valid ) , dtype = np.int32 )
+        if len(ids) > 0 :
+            bm_verts = bm.verts
+            self.verts_co[ids] = [ bm_verts[i].co for i in ids.tolist() ]
+            # 法線は隣接頂点も変わる
+            ring = np.union1d( ids , self.edges_idx[ self.vert_edges( ids ) ] )
+            self.verts_no[ring] = [ bm_verts[i].normal for i in ring.tolist() ]
+            if self.mirror is not None :
+                self.mirror.patch( ids )
+            if self.points is not None :
+                self.points.update( ids , self.verts_co[ids] )
+        self.journal_serial = self.journal_serial + 1
+        self.journal.append( ( self.journal_serial , ids ) )
+        if len(self.journal) > self.journal_size :
+            self.journal.popleft()
+
+    def moved_since( self , serial ) :
+        """Vertex ids moved after serial, or None when the journal cannot tell."""
+        if serial == self.journal_serial :
+            return np.empty( 0 , dtype = np.int32 )
+        if not self.journal or self.journal[0][0] > serial + 1 :
+            return None
+        moved = [ ids for s , ids in self.journal if s > serial ]
+        return np.unique( np.concatenate( moved ) )
+
+    def is_journaled_since( self , serial ) -> bool :
+        """True when something changed after serial and all of it is in the journal."""
+        return serial != self.journal_serial and bool(self.journal) and self.journal[0][0] <= serial + 1
+
+    def matches( self , bm ) -> bool :
+        """Cheap check that bm still has the snapshot's element counts and sampled vertex positions."""
+        if not ( self.is_valid and self.is_positions_valid ) :
+            return False
+        if len(bm.verts) != len(self.verts_co) or len(bm.edges) != len(self.edges_idx) or len(bm.faces) != len(self.faces_loop_start) :
+            return False
+        if len(bm.verts) == 0 :
+            return True
+        bm.verts.ensure_lookup_table()
+        bm_verts = bm.verts
+        ids = np.linspace( 0 , len(bm_verts) - 1 , min( self.match_samples , len(bm_verts) ) ).astype( np.int64 )
+        co = np.array( [ bm_verts[i].co for i in ids.tolist() ] , dtype = np.float32 )
+        return bool( np.array_equal( co , self.verts_co[ids] ) )
+
+    def mirror_map( self , threshold ) -> QMeshMirror :
+        """X mirror map of the current topology ; call after update()."""
+        if self.mirror is None or self.mirror.threshold != threshold :
+            self.mirror = QMeshMirror( self , threshold )
+        return self.mirror
+
+    def point_index( self , cell ) -> QMeshPointIndex :
+        """Spatial index of verts_co ; call after update()."""
+        # 結合距離の設定が変わったらセルの大きさが合わないので作り直す
+        if self.points is None or self.points.cell != max( cell , 1e-9 ) :
+            self.points = QMeshPointIndex( self.verts_co , cell )
+        return self.points
+
+    def vert_edges( self , ids ) :
+        """Edge ids linked to the given vertex ids."""
+        if self.__vert_edges is None :
+            flat = self.edges_idx.reshape(-1)
+            order = np.argsort( flat , kind = 'stable' )
+            offsets = np.zeros( len(self.verts_co) + 1 , dtype = np.int64 )
+            np.cumsum( np.bincount( flat , minlength = len(self.verts_co) ) , out = offsets[1:] )
+            self.__vert_edges = ( order // 2 , offsets )
+        edge_of , offsets = self.__vert_edges
+        starts = offsets[ids]
+        idx = np_math.csr_gather( starts , offsets[ids + 1] - starts )
+        return np.unique( edge_of[idx] )
+
+    @staticmethod
+    def face_hash( verts , starts ) :
+        """Order independent hash of the vertex sets verts[starts[i]:starts[i+1]] ; equal sets give equal keys."""
+        verts = np.asarray( verts , dtype = np.int64 )
+        a = np.add.reduceat( verts , starts )
+        b = np.add.reduceat( verts * verts , starts )
+        c = np.bitwise_xor.reduceat( ( verts + 1 ) * 2654435761 , starts )
+        n = np.diff( np.append( starts , len(verts) ) )
+        return ( a * 1000003 + b * 31 + n ) ^ ( c << 7 )
+
+    @staticmethod
+    def sorted_sets( verts , starts ) :
+        """Each vertex set sorted in place (same starts) and the set sizes."""
+        verts = np.asarray( verts , dtype = np.int64 )
+        n = np.diff( np.append( starts , len(verts) ) )
+        owner = np.repeat( np.arange( len(starts) ) , n )
+        return verts[ np.lexsort( ( verts , owner ) ) ] , n
+
+    def face_keys( self ) :
+        """( sorted keys , face order , sorted face verts , face sizes ) of the faces by vertex set."""
+        if self.__face_keys is None :
+            starts = self.faces_loop_start
+            if len(starts) == 0 :
+                empty = np.empty( 0 , dtype = np.int64 )
+                self.__face_keys = ( empty , empty , empty , empty )
+            else :
+                key = self.face_hash( self.loops_vert , starts )
+                order = np.argsort( key , kind = 'stable' )
+                self.__face_keys = ( key[order] , order ) + self.sorted_sets( self.loops_vert , starts )
+        return self.__face_keys
+
+    def find_faces( self , verts , starts ) :
+        """Face ids whose vertex set is verts[starts[i]:starts[i+1]] (-1 = none) ; call after update()."""
+        starts = np.asarray( starts , dtype = np.int64 )
+        result = np.full( len(starts) , -1 , dtype = np.int64 )
+        sorted_keys , order , face_verts , face_sizes = self.face_keys()
+        if len(starts) == 0 or len(sorted_keys) == 0 :
+            return result
+        key = self.face_hash( verts , starts )
+        query_verts , query_sizes = self.sorted_sets( verts , starts )
+
+        # 同じキーの面を全部 , 頂点の集合そのもので比べる (キーは衝突する)
+        lo = np.searchsorted( sorted_keys , key , side = 'left' )
+        run = np.searchsorted( sorted_keys , key , side = 'right' ) - lo
+        q = np.repeat( np.arange( len(starts) ) , run )
+        f = order[ np_math.csr_gather( lo , run ) ]
+        same = face_sizes[f] == query_sizes[q]
+        q , f = q[same] , f[same]
+        if len(q) == 0 :
+            return result
+        n = query_sizes[q]
+        a = query_verts[ np_math.csr_gather( starts[q] , n ) ]
+        b = face_verts[ np_math.csr_gather( self.faces_loop_start[f].astype( np.int64 ) , n ) ]
+        pair = np.repeat( np.arange( len(q) ) , n )
+        equal = np.bincount( pair[ a != b ] , minlength = len(q) ) == 0
+        # 後から書いた方が残るので逆順にして最初の面を使う
+        result[ q[equal][::-1] ] = f[equal][::-1]
+        return result
+
+    def triangles( self , bm ) :
+        """Vertex ids (t,3) of the loop triangles of visible faces."""
+        if self.__tris is None :
+            mesh = self.__scratch_mesh()
+            if mesh is not None :
+                try :
+                    bm.to_mesh(mesh)
+                    tris = np.empty( len(mesh.loop_triangles) * 3 , dtype = np.int32 )
+                    mesh.loop_triangles.foreach_get( 'vertices' , tris )
+                    polys = np.empty( len(mesh.loop_triangles) , dtype = np.int32 )
+                    mesh.loop_triangles.foreach_get( 'polygon_index' , polys )
+                    hide = np.empty( len(mesh.polygons) , dtype = bool )
+                    mesh.polygons.foreach_get( 'hide' , hide )
+                    tris = tris.reshape(-1,3)[ ~hide[polys] ]
+                finally :
+                    mesh.clear_geometry()
+            else :
+                bm.verts.index_update()
+                tris = [ [ l.vert.index for l in tri ] for tri in bm.calc_loop_triangles() if not tri[0].face.hide ]
+                tris = np.array( tris , dtype = np.int32 ).reshape(-1,3)
+            self.__tris = tris
+        return self.__tris
+
+    def update( self , bm ) :
+        if self.is_valid and self.is_positions_valid :
+            return self
+        bm.verts.ensure_lookup_table()
+        bm.edges.ensure_lookup_table()
+        vlen = len(bm.verts)
+        elen = len(bm.edges)
+        topology = not self.is_valid
+
+        self.verts_co = self.buffer( 'verts_co' , (vlen,3) , np.float32 )
+        self.verts_no = self.buffer( 'verts_no' , (vlen,3) , np.float32 )
+        if topology :
+            self.edges_idx = self.buffer( 'edges_idx' , (elen,2) , np.int32 )
+            self.verts_hide = self.buffer( 'verts_hide' , (vlen,) , bool )
+            self.edges_hide = self.buffer( 'edges_hide' , (elen,) , bool )
+            self.edges_faces = self.buffer( 'edges_faces' , (elen,) , np.int32 )
+
+        mesh = self.__scratch_mesh()
+        if mesh is not None :
+            try :
+                self.__export_mesh( bm , mesh , topology )
+            finally :
+                mesh.clear_geometry()
+        else :
+            self.__export_bmesh( bm , topology )
+
+        if topology :
+            self.__calc_flags()
+        if self.points is not None :
+            self.points.sync( self.verts_co )
+
+        self.is_valid = True
+        self.is_positions_valid = True
+        return self
+
+    def __calc_flags( self ) :
+        # BMEdge/BMVert の is_boundary , is_wire , is_manifold 相当を一括で求める
+        vlen = len(self.verts_co)
+        edges = self.edges_idx
+        faces = self.edges_faces
+        self.edges_boundary = faces == 1
+        self.edges_wire = faces == 0
+
+        def count( mask ) :
+            return np.bincount( edges[mask].reshape(-1) , minlength = vlen )
+
+        link = np.bincount( edges.reshape(-1) , minlength = vlen )
+        wire = count( self.edges_wire )
+        boundary = count( self.edges_boundary )
+        self.verts_boundary = boundary > 0
+        self.verts_wire = ( link > 0 ) & ( wire == link )
+        # 面を共有せず辺が全て2面のボウタイ頂点は判定できない
+        self.verts_nonmanifold = ( link == 0 ) | ( wire > 0 ) | ( boundary > 2 ) | ( count( faces > 2 ) > 0 )
+
+        # edgering 用の候補マスク
+        self.verts_ring = self.verts_boundary | self.verts_wire | self.verts_nonmanifold
+        self.edges_ring = self.edges_boundary | self.edges_wire
+
+    @classmethod
+    def __scratch_mesh( cls ) :
+        # 毎回 ID を足したり消したりせず 1つを使い回す (使用者0なので保存されない)
+        mesh = bpy.data.meshes.get( cls.scratch_name )
+        if mesh is not None and mesh.users == 0 :
+            return mesh
+        # ID の書き込みが禁止されているコンテキスト(描画中など)では None
+        try :
+            return bpy.data.meshes.new( cls.scratch_name )
+        except ( AttributeError , RuntimeError ) :
+            return None
+
+    def __export_mesh( self , bm , mesh , topology ) :
+        # BMesh.to_mesh は C 側で一括コピーされるので foreach_get で取り出す
+        bm.to_mesh(mesh)
+        mesh.vertices.foreach_get( 'co' , self.verts_co.reshape(-1) )
+        mesh.vertex_normals.foreach_get( 'vector' , self.verts_no.reshape(-1) )
+        if topology :
+            mesh.edges.foreach_get( 'vertices' , self.edges_idx.reshape(-1) )
+            mesh.vertices.foreach_get( 'hide' , self.verts_hide )
+            mesh.edges.foreach_get( 'hide' , self.edges_hide )
+            loops = self.buffer( 'loops_edge' , (len(mesh.loops),) , np.int32 )
+            mesh.loops.foreach_get( 'edge_index' , loops )
+            self.edges_faces[:] = np.bincount( loops , minlength = len(self.edges_faces) )
+            self.faces_loop_start = self.buffer( 'faces_loop_start' , (len(mesh.polygons),) , np.int32 )
+            mesh.polygons.foreach_get( 'loop_start' , self.faces_loop_start )
+            self.loops_vert = self.buffer( 'loops_vert' , (len(mesh.loops),) , np.int32 )
+            mesh.loops.foreach_get( 'vertex_index' , self.loops_vert )
+
+    def __export_bmesh( self , bm , topology ) :
+        bm.verts.index_update()
+        vlen = len(bm.verts)
+        elen = len(bm.edges)
+        self.verts_co[:] = np.fromiter( ( x for v in bm.verts for x in v.co ) , dtype = np.float32 , count = vlen * 3 ).reshape(vlen,3)
+        self.verts_no[:] = np.fromiter( ( x for v in bm.verts for x in v.normal ) , dtype = np.float32 , count = vlen * 3 ).reshape(vlen,3)
+        if topology :
+            self.edges_idx[:] = np.fromiter( ( v.index for e in bm.edges for v in e.verts ) , dtype = np.int32 , count = elen * 2 ).reshape(elen,2)
+            self.verts_hide[:] = np.fromiter( ( v.hide for v in bm.verts ) , dtype = bool , count = vlen )
+            self.edges_hide[:] = np.fromiter( ( e.hide for e in bm.edges ) , dtype = bool , count = elen )
+            self.edges_faces[:] = np.fromiter( ( len(e.link_faces) for e in bm.edges ) , dtype = np.int32 , count = elen )
+            self.loops_vert = np.fromiter( ( v.index for f in bm.faces for v in f.verts ) , dtype = np.int32 )
+            totals = np.fromiter( ( len(f.verts) for f in bm.faces ) , dtype = np.int32 , count = len(bm.faces) )
+            self.faces_loop_start = ( np.cumsum( totals ) - totals ).astype( np.int32 )
@@ -18,13 +18,341 @@ import copy
 import mathutils
 import bpy_extras
 import collections
+import hashlib
+import concurrent.futures
+import threading
+import numpy as np
 from mathutils import *
 from .QMeshOperators import *
+from .QSnapProxy import QSnapProxy
+from .QSnapField import QSnapField
 from ..utils import pqutil
 
+class QSnapTreeCache :
+    """
+    BVH trees of snap objects kept across tool sessions.
+    Keyed by object, reused while the evaluated geometry hash is unchanged,
+    evicted least recently used first once the memory budget is exceeded.
+    Trees are built on a worker thread from array copies of the evaluated mesh.
+    The list conversion runs in chunks so the UI thread can run in between,
+    but BVHTree.FromPolygons holds the GIL for its whole duration ; the header
+    says so while a build is running.
+    """
+    # tolist を分ける行数 (間で他のスレッドに GIL を渡す)
+    chunk_rows = 1 << 16
+    __executor = None
+
+    def __init__( self ) :
+        self.__entries = collections.OrderedDict()
+        # key -> ( geom , future , size , cancel )
+        self.__pending = {}
+        # 作れなかった形状 key -> geom , 形状が変わるまでスナップしない
+        self.__failed = {}
+        self.nbytes = 0
+
+    @classmethod
+    def executor( cls ) :
+        if cls.__executor is None :
+            cls.__executor = concurrent.futures.ThreadPoolExecutor( max_workers = 1 , thread_name_prefix = 'PolyQuiltBVH' )
+        return cls.__executor
+
+    def shutdown( self ) :
+        """Stop the worker thread ; unfinished builds are dropped, finished trees stay cached."""
+        executor = QSnapTreeCache.__executor
+        QSnapTreeCache.__executor = None
+        for geom , future , size , cancel in self.__pending.values() :
+            cancel.set()
+            future.cancel()
+        self.__pending.clear()
+        if executor is not None :
+            executor.shutdown( wait = False , cancel_futures = True )
+
+    @staticmethod
+    def geometry_key( obj , depsgraph ) :
+        mesh = obj.evaluated_get( depsgraph ).data
+        co = np.empty( len(mesh.vertices) * 3 , dtype = np.float32 )
+        mesh.vertices.foreach_get( 'co' , co )
+        loops = np.empty( len(mesh.loops) , dtype = np.int32 )
+        mesh.loops.foreach_get( 'vertex_index' , loops )
+        digest = hashlib.blake2b( co , digest_size = 16 )
+        digest.update( loops )
+        return ( len(mesh.vertices) , len(mesh.polygons) , digest.digest() )
+
+    @staticmethod
+    def estimate_size( obj , depsgraph ) :
+        # BVH ノードと座標コピーのおおよその大きさ
+        mesh = obj.evaluated_get( depsgraph ).data
+        return len(mesh.loop_triangles) * 76 + len(mesh.vertices) * 12
+
+    @staticmethod
+    def mesh_arrays( obj , depsgraph ) :
+        # ワーカースレッドには bpy のデータを渡さない
+        mesh = obj.evaluated_get( depsgraph ).data
+        co = np.empty( len(mesh.vertices) * 3 , dtype = np.float32 )
+        mesh.vertices.foreach_get( 'co' , co )
+        tris = np.empty( len(mesh.loop_triangles) * 3 , dtype = np.int32 )
+        mesh.loop_triangles.foreach_get( 'vertices' , tris )
+        return co.reshape(-1,3) , tris.reshape(-1,3)
+
+    @classmethod
+    def build( cls , co , tris , proxy_target , cancel = None ) :
+        if proxy_target and len(tris) > proxy_target :
+            return QSnapProxy( co , tris , proxy_target )
+        co = cls.__tolist( co , cancel )
+        tris = cls.__tolist( tris , cancel )
+        # ここは GIL を握ったまま
+        return mathutils.bvhtree.BVHTree.FromPolygons( co , tris , epsilon = 0.0 )
+
+    @classmethod
+    def __tolist( cls , array , cancel ) :
+        result = []
+        for start in range( 0 , len(array) , cls.chunk_rows ) :
+            if cancel is not None and cancel.is_set() :
+                raise concurrent.futures.CancelledError()
+            result.extend( array[ start : start + cls.chunk_rows ].tolist() )
+        return result
+
+    def get( self , obj , depsgraph , budget , proxy_target = 0 ) :
+        """BVH (or QSnapProxy) of obj, or None while it is still being built."""
+        key = obj.as_pointer()
+        geom = self.geometry_key( obj , depsgraph )
+        if proxy_target and len( obj.evaluated_get( depsgraph ).data.loop_triangles ) > proxy_target :
+            geom = geom + ( proxy_target , )
+        entry = self.__entries.get(key)
+        if entry is not None and entry[0] == geom :
+            self.__entries.move_to_end(key)
+            return entry[1]
+        if entry is not None :
+            self.__remove(key)
+        pending = self.__pending.get(key)
+        if pending is not None and pending[0] == geom :
+            return self.poll( obj , budget )
+        # 形状が変わった作りかけの結果は止めて捨てる (poll からは見えなくなる)
+        if pending is not None :
+            pending[3].set()
+            pending[1].cancel()
+            del self.__pending[key]
+        if self.__failed.get(key) == geom :
+            return None
+        co , tris = self.mesh_arrays( obj , depsgraph )
+        cancel = threading.Event()
+        future = self.executor().submit( self.build , co , tris , proxy_target , cancel )
+        self.__pending[key] = ( geom , future , self.estimate_size( obj , depsgraph ) , cancel )
+        return None
+
+    def poll( self , obj , budget ) :
+        """Move a finished build into the cache. Returns the tree or None."""
+        key = obj.as_pointer()
+        pending = self.__pending.get(key)
+        if pending is None :
+            entry = self.__entries.get(key)
+            return entry[1] if entry is not None else None
+        geom , future , size , cancel = pending
+        if not future.done() :
+            return None
+        del self.__pending[key]
+        try :
+            bvh = future.result()
+        except Exception as e :
+            # タイマーまで例外を上げない , この形状ではスナップしない
+            self.__failed[key] = geom
+            print( "PolyQuilt : snap tree build failed : {}".format( e ) )
+            return None
+        self.__failed.pop( key , None )
+        if isinstance( bvh , QSnapProxy ) :
+            size = bvh.nbytes
+        self.__entries[key] = ( geom , bvh , size )
+        self.nbytes = self.nbytes + size
+        self.trim( budget , keep = key )
+        return bvh
+
+    @property
+    def building( self ) -> int :
+        return len(self.__pending)
+
+    def is_pending( self , obj ) -> bool :
+        return obj.as_pointer() in self.__pending
+
+    def trim( self , budget , keep = None ) :
+        for key in list( self.__entries.keys() ) :
+            if self.nbytes <= budget :
+                break
+            if key != keep :
+                self.__remove(key)
+
+    def __remove( self , key ) :
+        geom , bvh , size = self.__entries.pop(key)
+        self.nbytes = self.nbytes - size
+
+    def clear( self ) :
+        self.__entries.clear()
+        self.__pending.clear()
+        self.__failed.clear()
+        self.nbytes = 0
+
+    def __len__( self ) :
+        return len(self.__entries)
+
+QSnapTransform = collections.namedtuple( 'QSnapTransform' , [ 'matrix' , 'matrix_inv' , 'normal_matrix' , 'np_matrix' , 'np_matrix_inv' ] )
+
+class QSnapVolumes :
+    """
+    World space bounding boxes of the snap objects.
+    Culls objects before the per object BVH query; refit when an object moves.
+    """
+    # BVH の誤差分だけ箱を広げる
+    margin = 1e-5
+
+    def __init__( self ) :
+        self.__boxes = {}
+        self.__arrays = None
+
+    def set( self , obj , matrix ) :
+        corners = np.array( [ tuple( matrix @ mathutils.Vector(c) ) for c in obj.bound_box ] , dtype = np.float64 )
+        self.__boxes[obj] = ( corners.min( axis = 0 ) - self.margin , corners.max( axis = 0 ) + self.margin )
+        self.__arrays = None
+
+    def remove( self , obj ) :
+        if self.__boxes.pop( obj , None ) is not None :
+            self.__arrays = None
+
+    def clear( self ) :
+        self.__boxes.clear()
+        self.__arrays = None
+
+    def __len__( self ) :
+        return len(self.__boxes)
+
+    @property
+    def arrays( self ) :
+        # ( objects , mins (n,3) , maxs (n,3) )
+        if self.__arrays is None :
+            objects = list( self.__boxes.keys() )
+            mins = np.array( [ self.__boxes[o][0] for o in objects ] , dtype = np.float64 ).reshape(-1,3)
+            maxs = np.array( [ self.__boxes[o][1] for o in objects ] , dtype = np.float64 ).reshape(-1,3)
+            self.__arrays = ( objects , mins , maxs )
+        return self.__arrays
+
+    @staticmethod
+    def slab( mins , maxs , origins , vectors ) :
+        """Ray/box test broadcasting over boxes and rays ; True where the ray (t>=0) enters the box."""
+        with np.errstate( divide = 'ignore' , invalid = 'ignore' ) :
+            inv = 1.0 / vectors
+            t0 = ( mins - origins ) * inv
+            t1 = ( maxs - origins ) * inv
+        near = np.fmax.reduce( np.fmin( t0 , t1 ) , axis = -1 )
+        far = np.fmin.reduce( np.fmax( t0 , t1 ) , axis = -1 )
+        return far >= np.maximum( near , 0.0 )
+
+    @staticmethod
+    def distance( mins , maxs , points ) :
+        """Distance from points to boxes (lower bound of the distance to anything inside)."""
+        d = np.maximum( np.maximum( mins - points , points - maxs ) , 0.0 )
+        return np.sqrt( ( d * d ).sum( axis = -1 ) )
+
+    def ray( self , origin , vector ) :
+        objects , mins , maxs = self.arrays
+        if not objects :
+            return set()
+        mask = self.slab( mins , maxs , np.array( origin , dtype = np.float64 ) , np.array( vector , dtype = np.float64 ) )
+        return { objects[i] for i in np.flatnonzero( mask ).tolist() }
+
+    def nearest_order( self , point ) :
+        # 箱までの距離の近い順に ( 距離 , obj )
+        objects , mins , maxs = self.arrays
+        if not objects :
+            return []
+        dist = self.distance( mins , maxs , np.array( point , dtype = np.float64 ) )
+        return [ ( dist[i] , objects[i] ) for i in np.argsort( dist , kind = 'stable' ).tolist() ]
+
+class QSnapVisibilityCache :
+    """
+    is_target results keyed by quantised world position, or by an explicit key
+    such as ( mesh , vertex index , topology version ) for points that move.
+    Valid for one view matrix and one snap target generation.
+    """
+    hits = 0
+    misses = 0
+    max_entries = 1 << 16
+
+    def __init__( self ) :
+        self.__table = {}
+        self.__token = None
+
+    def validate( self , token ) :
+        # ビューかスナップ対象が変わったら全部捨てる
+        if token != self.__token or len(self.__table) > self.max_entries :
+            self.__table.clear()
+            self.__token = token
+
+    def get( self , world_pos , quantum , calc , key = None ) :
+        if key is None :
+            key = ( round( world_pos[0] / quantum ) , round( world_pos[1] / quantum ) , round( world_pos[2] / quantum ) )
+        ret = self.__table.get(key)
+        if ret is not None :
+            QSnapVisibilityCache.hits = QSnapVisibilityCache.hits + 1
+            return ret
+        QSnapVisibilityCache.misses = QSnapVisibilityCache.misses + 1
+        ret = calc()
+        self.__table[key] = ret
+        return ret
+
+    def clear( self ) :
+        self.__table.clear()
+        self.__token = None
+
+    def __len__( self ) :
+        return len(self.__table)
+
+    @classmethod
+    def stats( cls ) :
+        total = cls.hits + cls.misses
+        return cls.hits , cls.misses , ( cls.hits / total if total else 0.0 )
+
+class QSnapHit :
+    """Single snap hit : object slot , loop triangle id (-1 if unknown) , distance."""
+    __slots__ = ( 'slot' , 'prim' , 'distance' )
+
+    def __init__( self , slot , prim , distance ) :
+        self.slot = slot
+        self.prim = prim
+        self.distance = distance
+
+    @property
+    def object( self ) :
+        return QSnap.slot_object( self.slot )
+
+class QSnapHits :
+    """
+    Batched snap hits, one row per query.
+    slot is -1 for a miss ; prim is the loop triangle of the slot's evaluated mesh,
+    -1 when only the decimated proxy was queried.
+    """
+    __slots__ = ( 'location' , 'normal' , 'slot' , 'prim' , 'barycentric' , 'distance' )
+
+    def __init__( self , location , normal ) :
+        n = len(location)
+        self.location = location.copy()
+        self.normal = normal
+        self.slot = np.full( n , -1 , dtype = np.int32 )
+        self.prim = np.full( n , -1 , dtype = np.int32 )
+        self.barycentric = np.full( ( n , 3 ) , np.nan )
+        self.distance = np.full( n , np.inf )
+
+    @property
+    def hit( self ) :
+        return self.slot >= 0
+
+    def __len__( self ) :
+        return len(self.slot)
+
 class QSnap :
     instance = None
     ref = 0
+    tree_cache = QSnapTreeCache()
+    # オブジェクトのカスタムプロパティ名
+    exclude_property = 'polyquilt_snap_exclude'
+    target_property = 'polyquilt_snap_target'
 
     @classmethod
     def add_ref( cls , context ) :
@@ -40,6 +368,14 @@ class QSnap :
             if cls.instance :
                 del cls.instance
                 cls.instance = None
+            cls.shutdown()
+
+    @classmethod
+    def shutdown( cls ) :
+        """Stop the build poll timer and the tree cache worker."""
+        if bpy.app.timers.is_registered( QSnap.poll_builds ) :
+            bpy.app.timers.unregister( QSnap.poll_builds )
+        cls.tree_cache.shutdown()
 
     @classmethod
     def is_active( cls ) :
@@ -56,42 +392,307 @@ class QSnap :
         if cls.instance :
             cls.instance.__update(context)
 
+    @classmethod
+    def depsgraph_update( cls , depsgraph ) :
+        if cls.instance != None and cls.instance.bvh_list is not None and depsgraph is not None :
+            cls.instance.__depsgraph_update( depsgraph )
+
     def __init__( self , context, snap_objects = 'Visible'  ) :
+        # snap_objects の結果と、それを求めた時の ( 範囲 , コレクション , アクティブ )
         self.objects_array = None
+        self.objects_key = None
+        # 選び直しが要るかをシーンの更新のたびに比べる値
+        self.objects_signature = None
         self.bvh_list = None
+        self.triangles_list = None
+        # obj -> QSnapTransform
+        self.matrices = {}
+        self.volumes = QSnapVolumes()
+        self.visibility = QSnapVisibilityCache()
+        self.field = None
+        # 一度割り当てたスロット番号はインスタンスが生きている間変わらない
+        self.slots = []
+        self.slot_of = {}
+        self.triangle_arrays = {}
+        self.dirty = set()
+        # バックグラウンドでツリーを作っているオブジェクト
+        self.pending = set()
+        self.generation = 0
 
     def __update( self , context ) :
         if context.scene.tool_settings.use_snap:
                 if self.bvh_list == None :
                     self.create_tree(context)
                 else :
-                    if set( self.bvh_list.keys() ) != set(self.snap_objects(context)) :
-                        self.remove_tree()
-                        self.create_tree(context)
+                    objects = self.snap_objects(context)
+                    known = self.bvh_list.keys() | self.pending
+                    if self.dirty or self.pending or len(objects) != len(known) or any( obj not in known for obj in objects ) :
+                        self.__refresh_tree( context , objects )
         else :
             if self.bvh_list != None :
                 self.remove_tree()
 
+    def __depsgraph_update( self , depsgraph ) :
+        scope , collection = self.objects_key[:2] if self.objects_key else ( None , None )
+        for update in depsgraph.updates :
+            id = update.id.original
+            if isinstance( id , bpy.types.Scene ) :
+                # シーンはほぼ毎回来るので 範囲に関わる選択か表示が変わった時だけ
+                if self.objects_array is not None and self.scope_signature( bpy.context , scope ) != self.objects_signature :
+                    self.objects_array = None
+                continue
+            if isinstance( id , bpy.types.Collection ) :
+                if self.__is_scope_collection( id , scope , collection ) :
+                    self.objects_array = None
+                continue
+            if isinstance( id , bpy.types.Object ) :
+                # 移動や形状の変化では選び直さない (表示やプロパティの変化だけ)
+                if id != bpy.context.active_object and not ( update.is_updated_transform or update.is_updated_geometry ) :
+                    self.objects_array = None
+                objects = [ id ] if id in self.bvh_list or id in self.pending else []
+            elif isinstance( id , bpy.types.Mesh ) :
+                try :
+                    objects = [ obj for obj in self.bvh_list.keys() | self.pending if obj.data == id ]
+                except ReferenceError :
+                    # 削除されたオブジェクトは次の update で外れる
+                    continue
+            else :
+                continue
+            for obj in objects :
+                if update.is_updated_geometry :
+                    self.dirty.add( obj )
+                elif update.is_updated_transform and obj in self.bvh_list :
+                    # 移動だけならツリーはそのまま
+                    self.__set_matrix( obj )
+
+    def __set_matrix( self , obj ) :
+        matrix = obj.matrix_world.copy()
+        matrix_inv = matrix.inverted()
+        self.matrices[obj] = QSnapTransform( matrix , matrix_inv , matrix.transposed().to_3x3() ,
+            np.array( matrix , dtype = np.float64 ) , np.array( matrix_inv , dtype = np.float64 ) )
+        self.volumes.set( obj , matrix )
+        self.triangles_list = None
+        self.generation = self.generation + 1
+
+    def __refresh_tree( self , context , objects ) :
+        # 増えた物と形状が変わった物だけ作り直す
+        current = set( objects )
+        for obj in [ obj for obj in self.bvh_list.keys() if obj not in current ] :
+            del self.bvh_list[obj]
+            self.matrices.pop( obj , None )
+            self.volumes.remove( obj )
+        self.pending &= current
+        depsgraph = context.evaluated_depsgraph_get()
+        budget = self.cache_budget( context )
+        proxy_target = self.proxy_target( context )
+        for obj in objects :
+            if obj not in self.bvh_list or obj in self.dirty :
+                self.__set_tree( obj , QSnap.tree_cache.get( obj , depsgraph , budget , proxy_target ) )
+        self.dirty.clear()
+        self.triangles_list = None
+        self.generation = self.generation + 1
+        self.__start_polling()
+
+    def __set_tree( self , obj , bvh ) :
+        # 出来上がるまではスナップ対象に入れない
+        if bvh is None :
+            self.pending.add( obj )
+            if obj in self.bvh_list :
+                del self.bvh_list[obj]
+                self.matrices.pop( obj , None )
+                self.volumes.remove( obj )
+        else :
+            self.pending.discard( obj )
+            self.bvh_list[obj] = bvh
+            if obj not in self.slot_of :
+                self.slot_of[obj] = len(self.slots)
+                self.slots.append( obj )
+            self.triangle_arrays.pop( self.slot_of[obj] , None )
+            self.__set_matrix( obj )
+
+    def __poll( self ) :
+        if self.bvh_list is None :
+            self.pending.clear()
+            return False
+        budget = self.cache_budget( bpy.context )
+        changed = False
+        for obj in list( self.pending ) :
+            try :
+                bvh = QSnap.tree_cache.poll( obj , budget )
+            except ReferenceError :
+                self.pending.discard( obj )
+                continue
+            if bvh is not None :
+                self.__set_tree( obj , bvh )
+                changed = True
+            elif not QSnap.tree_cache.is_pending( obj ) :
+                # 作れなかったのでスナップ対象から外す
+                self.pending.discard( obj )
+        if changed :
+            self.triangles_list = None
+            self.generation = self.generation + 1
+        return changed
+
+    def __start_polling( self ) :
+        if self.pending and not bpy.app.timers.is_registered( QSnap.poll_builds ) :
+            bpy.app.timers.register( QSnap.poll_builds , first_interval = 0.1 )
+
     @staticmethod
-    def snap_objects( context ) :
-        active_obj = context.active_object        
-        objects = context.visible_objects
-#           objects = context.selected_objects
-        objects_array = [obj for obj in objects if obj != active_obj and obj.type == 'MESH']
+    def poll_builds() :
+        # bpy.app.timers から呼ばれる
+        self = QSnap.instance
+        if self == None :
+            return None
+        if self.__poll() :
+            for window in bpy.context.window_manager.windows :
+                for area in window.screen.areas :
+                    if area.type == 'VIEW_3D' :
+                        area.tag_redraw()
+        return 0.2 if self.pending else None
+
+    @classmethod
+    def build_status( cls ) :
+        """Header text while snap trees are still being built."""
+        if cls.instance != None and cls.instance.pending :
+            # FromPolygons は GIL を離さないので作っている間は UI が止まることがある
+            return "Building snap trees ({}) , UI may pause".format( len(cls.instance.pending) )
+        return None
+
+    @classmethod
+    def snap_objects( cls , context ) :
+        # 範囲の設定かシーンが変わるまで使い回す
+        key = cls.target_scope( context ) + ( context.active_object , )
+        self = cls.instance
+        if self == None :
+            return cls.collect_snap_objects( context , key[0] , key[1] )
+        if self.objects_array == None or key != self.objects_key :
+            self.objects_array = self.collect_snap_objects( context , key[0] , key[1] )
+            self.objects_key = key
+            self.objects_signature = self.scope_signature( context , key[0] )
+        return self.objects_array
+
+    @staticmethod
+    def scope_signature( context , scope ) :
+        # 範囲ごとに対象の選び方に効く物だけ
+        if scope == 'SELECTED' :
+            return tuple( obj.as_pointer() for obj in context.selected_objects )
+        return tuple( obj.as_pointer() for obj in context.visible_objects )
+
+    @staticmethod
+    def __is_scope_collection( coll , scope , collection ) :
+        # 選択範囲ならメンバーの変化は選択の変化としてシーンで分かる
+        if scope == 'SELECTED' :
+            return False
+        if scope == 'COLLECTION' :
+            target = bpy.data.collections.get( collection )
+            return target is None or coll == target or coll in target.children_recursive
+        return True
+
+    @staticmethod
+    def target_scope( context ) :
+        addon = context.preferences.addons.get( __package__.rpartition('.')[0] )
+        if addon :
+            return ( addon.preferences.snap_target_scope , addon.preferences.snap_target_collection )
+        return ( 'VISIBLE' , '' )
+
+    @classmethod
+    def collect_snap_objects( cls , context , scope , collection ) :
+        active_obj = context.active_object
+        if scope == 'SELECTED' :
+            objects = context.selected_objects
+        elif scope == 'COLLECTION' :
+            coll = bpy.data.collections.get( collection )
+            objects = [ obj for obj in coll.all_objects if obj.visible_get() ] if coll else []
+        else :
+            objects = context.visible_objects
+        objects_array = [obj for obj in objects if obj != active_obj and obj.type == 'MESH' and not obj.get( cls.exclude_property , False ) ]
+        if scope == 'PROPERTY' :
+            objects_array = [ obj for obj in objects_array if obj.get( cls.target_property , False ) ]
         return objects_array
 
+    @staticmethod
+    def cache_budget( context ) :
+        addon = context.preferences.addons.get( __package__.rpartition('.')[0] )
+        budget = addon.preferences.snap_cache_budget if addon else 1024
+        return budget * 1024 * 1024
+
+    @staticmethod
+    def field_voxel( context ) :
+        # 0 ならフィールドを使わない
+        addon = context.preferences.addons.get( __package__.rpartition('.')[0] )
+        if addon and addon.preferences.use_snap_field :
+            return addon.preferences.snap_field_voxel
+        return 0.0
+
+    def __field( self ) :
+        # スナップ対象が変わるまでセッション中使い回す
+        voxel = self.field_voxel( bpy.context )
+        if voxel <= 0.0 or not self.bvh_list :
+            return None
+        token = ( self.generation , voxel )
+        if self.field is None or self.field.token != token :
+            self.field = QSnapField( voxel , self.__find_nearest_array , token )
+        return self.field
+
+    @staticmethod
+    def proxy_target( context ) :
+        # 0 なら間引きしない
+        addon = context.preferences.addons.get( __package__.rpartition('.')[0] )
+        if addon and addon.preferences.use_snap_proxy :
+            return addon.preferences.snap_proxy_triangles
+        return 0
+
     def create_tree( self , context ) :
         if self.bvh_list == None :
             self.bvh_list = {}
+            depsgraph = context.evaluated_depsgraph_get()
+            budget = self.cache_budget( context )
+            proxy_target = self.proxy_target( context )
             for obj in self.snap_objects(context):
-                bvh = mathutils.bvhtree.BVHTree.FromObject(obj, context.evaluated_depsgraph_get() , epsilon = 0.0 )
-                self.bvh_list[obj] = bvh
+                self.__set_tree( obj , QSnap.tree_cache.get( obj , depsgraph , budget , proxy_target ) )
+            self.dirty.clear()
+            self.__start_polling()
 
     def remove_tree( self ) :
-        if self.bvh_list != None :
-            for bvh in self.bvh_list.values():
-                del bvh
+        # ツリー自体は tree_cache に残して次のセッションで使い回す
         self.bvh_list = None
+        self.triangles_list = None
+        self.pending.clear()
+        self.triangle_arrays.clear()
+        self.matrices.clear()
+        self.volumes.clear()
+        self.generation = self.generation + 1
+
+    @classmethod
+    def targets_token( cls ) :
+        # スナップ対象か行列が変わったら別の値になる
+        if cls.instance != None and cls.instance.bvh_list :
+            return ( id(cls.instance) , cls.instance.generation )
+        return None
+
+    @classmethod
+    def triangles( cls , context ) :
+        """World space ( verts (n,3) , tris (t,3) ) of each snap object, for the depth buffer."""
+        if cls.instance == None or not cls.instance.bvh_list :
+            return []
+        self = cls.instance
+        if self.triangles_list == None :
+            self.triangles_list = []
+            depsgraph = context.evaluated_depsgraph_get()
+            for obj in self.bvh_list.keys() :
+                eval_obj = obj.evaluated_get( depsgraph )
+                mesh = eval_obj.to_mesh()
+                try :
+                    co = np.empty( len(mesh.vertices) * 3 , dtype = np.float32 )
+                    mesh.vertices.foreach_get( 'co' , co )
+                    tris = np.empty( len(mesh.loop_triangles) * 3 , dtype = np.int32 )
+                    mesh.loop_triangles.foreach_get( 'vertices' , tris )
+                finally :
+                    eval_obj.to_mesh_clear()
+                matrix = self.matrices[obj].np_matrix
+                co = co.reshape(-1,3) @ matrix[:3,:3].T + matrix[:3,3]
+                self.triangles_list.append( ( co , tris.reshape(-1,3) ) )
+        return self.triangles_list
 
 
     @classmethod
@@ -138,9 +739,9 @@ class QSnap :
     def adjust_by_normal( cls , world_pos : mathutils.Vector , world_normal : mathutils.Vector  , is_fix_to_x_zero = False ) :
         if cls.instance != None :
             ray = pqutil.Ray( world_pos , world_normal )
-            location , norm , index = cls.instance.__raycast_double( ray )
+            location , norm , index = cls.instance.__raycast_double( ray , exact = True )
             if location == None :
-                location , norm , index = cls.instance.__find_nearest( world_pos )
+                location , norm , index = cls.instance.__find_nearest( world_pos , exact = True )
             if location != None :
                 if norm is None :
                     norm = mathutils.Vector( (0,0,1) )
@@ -178,74 +779,197 @@ class QSnap :
     @classmethod
     def adjust_verts( cls , obj , verts , is_fix_to_x_zero ) :
         if cls.instance != None and cls.instance.bvh_list :
-            dist = bpy.context.scene.tool_settings.double_threshold                        
-            find_nearest =  cls.instance.__find_nearest
-            matrix = obj.matrix_world
-            for vert in verts :
-                location , norm , index = find_nearest( matrix @ vert.co )
-                if location != None :
-                    lp = obj.matrix_world.inverted() @ location
-                    if is_fix_to_x_zero and QMeshOperators.is_x_zero_pos(vert.co) :
-                        lp.x = 0
-                    vert.co = lp
+            verts = list(verts)
+            if not verts :
+                return
+            lp , hit = cls.adjust_locals( obj.matrix_world , [ v.co for v in verts ] , is_fix_to_x_zero , exact = True )
+            for vert , co in zip( verts , lp.tolist() ) :
+                vert.co = co
+
+    # 配列版 : オブジェクトごとに行列変換を1回だけ行い、BVH の問い合わせを詰めて回す
+    @classmethod
+    def adjust_points( cls , world_positions , is_fix_to_x_zero = False , approximate = False ) :
+        """Array form of adjust_point. (n,3) world positions -> ( positions (n,3) , normals (n,3) , hit mask (n,) ).
+        approximate uses the closest point field when it is enabled (brushes)."""
+        points = np.array( world_positions , dtype = np.float64 ).reshape(-1,3)
+        if cls.instance == None :
+            return points , cls.__up( len(points) ) , np.zeros( len(points) , dtype = bool )
+        location , normal , hit = cls.instance.__nearest( points , approximate = approximate )
+        if is_fix_to_x_zero :
+            cls.__fix_x_zero( location , normal )
+        return location , normal , hit
+
+    @classmethod
+    def adjust_by_normals( cls , world_positions , world_normals , is_fix_to_x_zero = False ) :
+        """Array form of adjust_by_normal. Rays missing every target fall back to the nearest point."""
+        points = np.array( world_positions , dtype = np.float64 ).reshape(-1,3)
+        normals = np.array( world_normals , dtype = np.float64 ).reshape(-1,3)
+        if cls.instance == None :
+            return points , normals , np.zeros( len(points) , dtype = bool )
+        location , normal , hit = cls.instance.__raycast_array( points , ( -normals , normals ) , exact = True )
+        miss = np.flatnonzero( ~hit )
+        if len(miss) > 0 :
+            location[miss] , normal[miss] , hit[miss] = cls.instance.__find_nearest_array( points[miss] , exact = True )
+        if is_fix_to_x_zero :
+            cls.__fix_x_zero( location , normal )
+        return location , normal , hit
+
+    @classmethod
+    def adjust_locals( cls , matrix_world : mathutils.Matrix , local_positions , is_fix_to_x_zero , exact = False , approximate = False ) :
+        """Array form of adjust_local. Returns ( local positions (n,3) , hit mask (n,) )."""
+        local = np.array( local_positions , dtype = np.float64 ).reshape(-1,3)
+        if cls.instance == None :
+            return local , np.zeros( len(local) , dtype = bool )
+        matrix = np.array( matrix_world , dtype = np.float64 )
+        matrix_inv = np.array( matrix_world.inverted() , dtype = np.float64 )
+        location , normal , hit = cls.instance.__nearest( local @ matrix[:3,:3].T + matrix[:3,3] , exact , approximate )
+        lp = local.copy()
+        lp[hit] = location[hit] @ matrix_inv[:3,:3].T + matrix_inv[:3,3]
+        if is_fix_to_x_zero :
+            dist = bpy.context.scene.tool_settings.double_threshold
+            lp[ np.abs( local[:,0] ) < dist , 0 ] = 0
+        return lp , hit
+
+    @classmethod
+    def nearest_hits( cls , world_positions , exact = False ) -> QSnapHits :
+        """Nearest surface points with object slot , loop triangle and barycentric coordinates."""
+        points = np.array( world_positions , dtype = np.float64 ).reshape(-1,3)
+        if cls.instance == None :
+            return QSnapHits( points , cls.__up( len(points) ) )
+        return cls.instance.__barycentric( cls.instance.__find_nearest_hits( points , exact ) )
 
     @classmethod
-    def is_target( cls , world_pos : mathutils.Vector) -> bool :
+    def raycast_hits( cls , origins , directions , exact = False ) -> QSnapHits :
+        """First hits along (n,3) world rays , as nearest_hits."""
+        origins = np.array( origins , dtype = np.float64 ).reshape(-1,3)
+        directions = np.array( directions , dtype = np.float64 ).reshape(-1,3)
+        if cls.instance == None :
+            return QSnapHits( origins , cls.__up( len(origins) ) )
+        return cls.instance.__barycentric( cls.instance.__raycast_hits( origins , ( directions , ) , exact ) )
+
+    @classmethod
+    def slot_object( cls , slot ) :
+        if cls.instance != None and 0 <= slot < len(cls.instance.slots) :
+            return cls.instance.slots[slot]
+        return None
+
+    @staticmethod
+    def __up( n ) :
+        return np.tile( ( 0.0 , 0.0 , 1.0 ) , ( n , 1 ) )
+
+    @staticmethod
+    def __fix_x_zero( location , normal ) :
         dist = bpy.context.scene.tool_settings.double_threshold
+        fix = np.abs( location[:,0] ) < dist
+        location[fix,0] = 0
+        normal[fix,0] = 0
+        length = np.linalg.norm( normal[fix] , axis = 1 , keepdims = True )
+        normal[fix] = normal[fix] / np.where( length > 0 , length , 1 )
+
+    @classmethod
+    def is_target( cls , world_pos : mathutils.Vector , key = None ) -> bool :
+        """key : cache key used instead of the quantised position (e.g. vertex id and geometry version)."""
         if cls.instance != None :
-            ray = pqutil.Ray.from_world_to_screen( bpy.context , world_pos )
-            if ray == None :
-                return False
-            hit , normal , face = cls.instance.__raycast( ray )
-            if hit != None :
-                v2h = (ray.origin - hit).length
-                v2w = (ray.origin - world_pos).length
-
-                if abs(v2h - v2w) <= dist :
-                    return True
-                else :
-                    ray2 = pqutil.Ray( hit + ray.vector * dist , ray.vector )
-                    hit2 , normal2 , face2 = cls.instance.__raycast( ray2 )
-                    if not hit2 :
-                        return False
-                    h2h = ( ray2.origin - hit2 ).length
-                    w2h0 = ( ray2.origin - world_pos ).length
-                    w2h1 = ( world_pos - hit2 ).length
-                    if w2h0 < h2h :
-                        if w2h0 < w2h1 :
-                            return True
-                return False
+            dist = bpy.context.scene.tool_settings.double_threshold
+            quantum = cls.instance.__validate_visibility( dist )
+            return cls.instance.visibility.get( world_pos , quantum , lambda : cls.instance.__is_target( world_pos , dist ) , key )
+        return True
+
+    @classmethod
+    def is_targets( cls , world_positions ) -> list :
+        """is_target for several points; snap object matrices are inverted once for the batch."""
+        if cls.instance != None :
+            dist = bpy.context.scene.tool_settings.double_threshold
+            quantum = cls.instance.__validate_visibility( dist )
+            targets = cls.instance.__targets()
+            get = cls.instance.visibility.get
+            is_target = cls.instance.__is_target
+            return [ get( p , quantum , lambda p = p : is_target( p , dist , targets ) ) for p in world_positions ]
+        return [ True ] * len(world_positions)
+
+    @classmethod
+    def visibility_stats( cls ) :
+        return QSnapVisibilityCache.stats()
+
+    def __validate_visibility( self , dist ) :
+        # 判定の許容誤差より十分細かく量子化する
+        rv3d = bpy.context.region_data
+        view = tuple( x for row in rv3d.perspective_matrix for x in row ) if rv3d else None
+        self.visibility.validate( ( view , self.generation , dist ) )
+        return max( dist * 0.25 , 1e-6 )
+
+    def __is_target( self , world_pos : mathutils.Vector , dist , targets = None ) -> bool :
+        ray = pqutil.Ray.from_world_to_screen( bpy.context , world_pos )
+        if ray == None :
+            return False
+        hit , normal , face = self.__raycast( ray , targets )
+        if hit != None :
+            v2h = (ray.origin - hit).length
+            v2w = (ray.origin - world_pos).length
+
+            if abs(v2h - v2w) <= dist :
+                return True
+            else :
+                ray2 = pqutil.Ray( hit + ray.vector * dist , ray.vector )
+                hit2 , normal2 , face2 = self.__raycast( ray2 , targets )
+                if not hit2 :
+                    return False
+                h2h = ( ray2.origin - hit2 ).length
+                w2h0 = ( ray2.origin - world_pos ).length
+                w2h1 = ( world_pos - hit2 ).length
+                if w2h0 < h2h :
+                    if w2h0 < w2h1 :
+                        return True
+            return False
         return True
 
-    def __raycast( self , ray : pqutil.Ray ) :
+    def __targets( self ) :
+        # ( obj , bvh , 逆行列 )
+        if self.bvh_list :
+            return [ ( obj , bvh , self.matrices[obj][1] ) for obj , bvh in self.bvh_list.items() ]
+        return []
+
+    @staticmethod
+    def __queries( bvh , exact ) :
+        # 確定する位置だけ間引き前の三角形で求め直す
+        if exact and isinstance( bvh , QSnapProxy ) :
+            return bvh.find_nearest_exact , bvh.ray_cast_exact
+        return bvh.find_nearest , bvh.ray_cast
+
+    def __raycast( self , ray : pqutil.Ray , targets = None , exact = False ) :
         min_dist = math.inf
         location = None
         normal = None
         index = None
-        if self.bvh_list :
-            for obj , bvh in self.bvh_list.items():
-                local_ray = ray.world_to_object( obj )
-                hit = bvh.ray_cast( local_ray.origin , local_ray.vector )
+        if targets is None :
+            targets = self.__targets()
+        if targets :
+            candidates = self.volumes.ray( ray.origin , ray.vector )
+            for obj , bvh , matrix_inv in targets :
+                if obj not in candidates :
+                    continue
+                origin = matrix_inv @ ray.origin
+                hit = self.__queries( bvh , exact )[1]( origin , matrix_inv @ ( ray.origin + ray.vector ) - origin )
                 if None not in hit :
                     if hit[3] < min_dist :
-                        matrix = obj.matrix_world
-                        location = pqutil.transform_position( hit[0] , matrix )
-                        normal = pqutil.transform_normal( hit[1] , matrix )
-                        index =  hit[2] + obj.pass_index * 10000000
+                        transform = self.matrices[obj]
+                        location = transform.matrix @ hit[0]
+                        normal = transform.normal_matrix @ hit[1]
+                        index = self.__record( obj , hit , hit[3] , exact )
                         min_dist = hit[3]
 
         return location , normal , index
 
-    def __raycast_double( self , ray : pqutil.Ray ) :
+    def __raycast_double( self , ray : pqutil.Ray , exact = False ) :
         # ターゲットからビュー方向にレイを飛ばす
-        location_r , normal_r , face_r = self.__raycast( ray.invert )
+        location_r , normal_r , face_r = self.__raycast( ray.invert , exact = exact )
 
 #        if face_r != None :
 #            print(ray.vector.dot( normal_r ))
 #            if ray.vector.dot( normal_r ) < -0.5 :
 #                return location_r , normal_r , face_r
 
-        location_i , normal_i , face_i = self.__raycast( ray )
+        location_i , normal_i , face_i = self.__raycast( ray , exact = exact )
 
         if face_i == None or face_r == None :
             if face_i != None :
@@ -259,23 +983,134 @@ class QSnap :
                 return location_i , normal_i , face_i        
         return None , None , None
 
-    def __find_nearest( self, pos : mathutils.Vector ) :
+    def __find_nearest( self, pos : mathutils.Vector , exact = False ) :
         min_dist = math.inf
         location = pos
         normal = None
         index = None
         hits = []
         if self.bvh_list :
-            for obj , bvh in self.bvh_list.items():
-                lp = obj.matrix_world.inverted() @ pos
-                hit = bvh.find_nearest( lp )
+            # 箱が今の最短より遠くなったら残りは調べない
+            for box_dist , obj in self.volumes.nearest_order( pos ) :
+                if box_dist > min_dist :
+                    break
+                bvh = self.bvh_list[obj]
+                transform = self.matrices[obj]
+                hit = self.__queries( bvh , exact )[0]( transform.matrix_inv @ pos )
                 if None not in hit :
-                    wp = pqutil.transform_position( hit[0] , obj.matrix_world )
+                    wp = transform.matrix @ hit[0]
                     dist = ( pos - wp ).length
                     if min_dist > dist :
                         min_dist = dist
                         location = wp
-                        normal = pqutil.transform_normal( hit[1] , obj.matrix_world )
-                        index =  hit[2] + obj.pass_index * 10000000
+                        normal = transform.normal_matrix @ hit[1]
+                        index = self.__record( obj , hit , dist , exact )
 
         return location , normal , index
+
+    def __nearest( self , points , exact = False , approximate = False ) :
+        field = self.__field() if approximate and not exact else None
+        if field is not None :
+            return field.lookup( points )
+        return self.__find_nearest_array( points , exact )
+
+    def __find_nearest_array( self , points , exact = False ) :
+        hits = self.__find_nearest_hits( points , exact )
+        return hits.location , hits.normal , hits.hit
+
+    def __raycast_array( self , origins , directions , exact = False ) :
+        hits = self.__raycast_hits( origins , directions , exact )
+        return hits.location , hits.normal , hits.hit
+
+    def __find_nearest_hits( self , points , exact = False ) :
+        hits = QSnapHits( points , self.__up( len(points) ) )
+        if self.bvh_list and len(points) > 0 :
+            objects , mins , maxs = self.volumes.arrays
+            box_dist = self.volumes.distance( mins[:,None,:] , maxs[:,None,:] , points[None,:,:] )
+            # 近い箱から調べて、最短距離より遠い箱の点は飛ばす
+            for i in np.argsort( box_dist.min( axis = 1 ) , kind = 'stable' ).tolist() :
+                rows = np.flatnonzero( box_dist[i] <= hits.distance )
+                if len(rows) == 0 :
+                    continue
+                obj = objects[i]
+                matrix_inv = self.matrices[obj].np_matrix_inv
+                local = points[rows] @ matrix_inv[:3,:3].T + matrix_inv[:3,3]
+                find_nearest = self.__queries( self.bvh_list[obj] , exact )[0]
+                results = [ find_nearest( p ) for p in local.tolist() ]
+                self.__gather( results , rows , obj , exact , points , hits )
+        return hits
+
+    def __raycast_hits( self , origins , directions , exact = False ) :
+        # directions の全ての向きの中で origin に最も近いヒットを取る
+        hits = QSnapHits( origins , self.__up( len(origins) ) )
+        if self.bvh_list and len(origins) > 0 :
+            objects , mins , maxs = self.volumes.arrays
+            for i , obj in enumerate( objects ) :
+                matrix_inv = self.matrices[obj].np_matrix_inv
+                ray_cast = self.__queries( self.bvh_list[obj] , exact )[1]
+                for vectors in directions :
+                    rows = np.flatnonzero( QSnapVolumes.slab( mins[i] , maxs[i] , origins , vectors ) )
+                    if len(rows) == 0 :
+                        continue
+                    local = origins[rows] @ matrix_inv[:3,:3].T + matrix_inv[:3,3]
+                    results = [ ray_cast( o , v ) for o , v in zip( local.tolist() , ( vectors[rows] @ matrix_inv[:3,:3].T ).tolist() ) ]
+                    self.__gather( results , rows , obj , exact , origins , hits )
+        return hits
+
+    def __gather( self , results , rows , obj , exact , reference , hits ) :
+        found = [ i for i , r in enumerate(results) if r[0] is not None ]
+        if not found :
+            return
+        matrix = self.matrices[obj].np_matrix
+        wp = np.array( [ results[i][0] for i in found ] ) @ matrix[:3,:3].T + matrix[:3,3]
+        ids = rows[found]
+        dist = np.linalg.norm( wp - reference[ids] , axis = 1 )
+        better = dist < hits.distance[ids]
+        found = [ i for i , b in zip( found , better.tolist() ) if b ]
+        rows = ids[better]
+        hits.location[rows] = wp[better]
+        # pqutil.transform_normal と同じ変換
+        hits.normal[rows] = np.array( [ results[i][1] for i in found ] ).reshape(-1,3) @ matrix[:3,:3]
+        hits.distance[rows] = dist[better]
+        hits.slot[rows] = self.slot_of[obj]
+        hits.prim[rows] = [ self.__prim( obj , results[i][2] , exact ) for i in found ]
+
+    def __prim( self , obj , index , exact ) :
+        # 間引いたツリーの三角形番号は元のメッシュと対応しない
+        if index is None or ( isinstance( self.bvh_list[obj] , QSnapProxy ) and not exact ) :
+            return -1
+        return index
+
+    def __record( self , obj , hit , distance , exact ) :
+        return QSnapHit( self.slot_of[obj] , self.__prim( obj , hit[2] , exact ) , distance )
+
+    def __triangle_arrays( self , slot ) :
+        # 重心座標用の ( 頂点 , ループ三角形 ) をオブジェクトごとに必要になった時だけ取る
+        arrays = self.triangle_arrays.get(slot)
+        if arrays is None :
+            arrays = QSnap.tree_cache.mesh_arrays( self.slots[slot] , bpy.context.evaluated_depsgraph_get() )
+            self.triangle_arrays[slot] = arrays
+        return arrays
+
+    def __barycentric( self , hits ) :
+        valid = hits.prim >= 0
+        for slot in np.unique( hits.slot[valid] ).tolist() :
+            obj = self.slots[slot]
+            co , tris = self.__triangle_arrays( slot )
+            rows = np.flatnonzero( valid & ( hits.slot == slot ) )
+            rows = rows[ hits.prim[rows] < len(tris) ]
+            matrix_inv = self.matrices[obj].np_matrix_inv
+            p = hits.location[rows] @ matrix_inv[:3,:3].T + matrix_inv[:3,3]
+            a , b , c = ( co[ tris[ hits.prim[rows] , k ] ].astype( np.float64 ) for k in range(3) )
+            v0 , v1 , v2 = b - a , c - a , p - a
+            d00 = ( v0 * v0 ).sum(1)
+            d01 = ( v0 * v1 ).sum(1)
+            d11 = ( v1 * v1 ).sum(1)
+            d20 = ( v2 * v0 ).sum(1)
+            d21 = ( v2 * v1 ).sum(1)
+            denom = d00 * d11 - d01 * d01
+            with np.errstate( divide = 'ignore' , invalid = 'ignore' ) :
+                v = ( d11 * d20 - d01 * d21 ) / denom
+                w = ( d00 * d21 - d01 * d20 ) / denom
+            hits.barycentric[rows] = np.stack( ( 1.0 - v - w , v , w ) , axis = 1 )
+        return hits
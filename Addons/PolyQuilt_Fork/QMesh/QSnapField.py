@@ -0,0 +1,115 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+from ..utils import np_math
+
+__all__ = ['QSnapField']
+
+class QSnapField :
+    """
+    Sparse voxel field of closest points / normals on the snap targets.
+    Bricks of brick_size^3 voxels are sampled where queries land and kept
+    until the snap targets change; lookups are trilinear and fully vectorised.
+    """
+    brick_size = 8
+    # 超えたら全部作り直す (1ブロック 約17KB)
+    max_bricks = 4096
+
+    def __init__( self , voxel , sample , token = None ) :
+        self.voxel = voxel
+        # (n,3) ワールド座標 -> ( 位置 , 法線 , ヒット )
+        self.sample = sample
+        self.token = token
+        self.clear()
+
+    def clear( self ) :
+        n = self.brick_size + 1
+        self.__slots = {}
+        self.points = np.empty( ( 0 , n , n , n , 3 ) , dtype = np.float32 )
+        self.normals = np.empty( ( 0 , n , n , n , 3 ) , dtype = np.float32 )
+        self.valid = np.empty( ( 0 , n , n , n ) , dtype = bool )
+        self.count = 0
+
+    def __len__( self ) :
+        return self.count
+
+    def lookup( self , points ) :
+        """World positions (n,3) -> ( closest points (n,3) , normals (n,3) , hit mask (n,) )."""
+        points = np.asarray( points , dtype = np.float64 ).reshape(-1,3)
+        location = points.copy()
+        normal = np.tile( ( 0.0 , 0.0 , 1.0 ) , ( len(points) , 1 ) )
+        if len(points) == 0 :
+            return location , normal , np.zeros( 0 , dtype = bool )
+
+        g = points / self.voxel
+        base = np.floor( g ).astype( np.int64 )
+        brick = np.floor_divide( base , self.brick_size )
+        local = base - brick * self.brick_size
+        frac = g - base
+        slots = self.__ensure( brick )
+
+        p = np.zeros( ( len(points) , 3 ) )
+        nrm = np.zeros( ( len(points) , 3 ) )
+        hit = np.ones( len(points) , dtype = bool )
+        for corner in ( (0,0,0) , (1,0,0) , (0,1,0) , (1,1,0) , (0,0,1) , (1,0,1) , (0,1,1) , (1,1,1) ) :
+            w = np.prod( np.where( corner , frac , 1.0 - frac ) , axis = 1 )[:,None]
+            i = local + corner
+            p += w * self.points[ slots , i[:,0] , i[:,1] , i[:,2] ]
+            nrm += w * self.normals[ slots , i[:,0] , i[:,1] , i[:,2] ]
+            hit &= self.valid[ slots , i[:,0] , i[:,1] , i[:,2] ]
+
+        length = np.linalg.norm( nrm , axis = 1 , keepdims = True )
+        location[hit] = p[hit]
+        normal[hit] = nrm[hit] / np.where( length[hit] > 0 , length[hit] , 1 )
+        return location , normal , hit
+
+    def __ensure( self , brick ) :
+        keys = np_math.pack_cells( brick )
+        uniq , first , inverse = np.unique( keys , return_index = True , return_inverse = True )
+        missing = [ i for i , k in enumerate( uniq.tolist() ) if k not in self.__slots ]
+        if self.count + len(missing) > self.max_bricks :
+            self.clear()
+            missing = list( range( len(uniq) ) )
+        if missing :
+            self.__build( uniq[missing].tolist() , brick[ first[missing] ] )
+        table = np.array( [ self.__slots[k] for k in uniq.tolist() ] , dtype = np.int64 )
+        return table[ inverse.reshape(-1) ]
+
+    def __build( self , keys , bricks ) :
+        n = self.brick_size + 1
+        start = self.count
+        self.__reserve( start + len(keys) )
+        r = np.arange( n )
+        lattice = np.stack( np.meshgrid( r , r , r , indexing = 'ij' ) , axis = -1 )
+        nodes = ( bricks[:,None,None,None,:] * self.brick_size + lattice[None] ) * self.voxel
+        location , normal , hit = self.sample( nodes.reshape(-1,3) )
+        stop = start + len(keys)
+        self.points[start:stop] = location.reshape( -1 , n , n , n , 3 )
+        self.normals[start:stop] = normal.reshape( -1 , n , n , n , 3 )
+        self.valid[start:stop] = hit.reshape( -1 , n , n , n )
+        for i , key in enumerate( keys ) :
+            self.__slots[key] = start + i
+        self.count = stop
+
+    def __reserve( self , size ) :
+        if size <= len(self.points) :
+            return
+        size = max( size , len(self.points) * 2 , 16 )
+        def grow( a ) :
+            b = np.empty( ( size , ) + a.shape[1:] , dtype = a.dtype )
+            b[:self.count] = a[:self.count]
+            return b
+        self.points = grow( self.points )
+        self.normals = grow( self.normals )
+        self.valid = grow( self.valid )
@@ -0,0 +1,156 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import numpy as np
+import mathutils
+from ..utils import np_math
+
+__all__ = ['QSnapProxy']
+
+class QSnapPatch :
+    __slots__ = ( 'tree' , 'ids' )
+
+    def __init__( self , tree , ids ) :
+        self.tree = tree
+        self.ids = ids
+
+class QSnapProxy :
+    """
+    Vertex clustered stand-in for a huge snap object.
+    find_nearest / ray_cast answer from the coarse tree; the *_exact variants
+    refine against a small BVH of the original triangles around the coarse hit.
+    Built on the tree cache worker thread, so only numpy and mathutils here.
+    """
+    # 近傍何セル分の三角形で正確な位置を求めるか
+    patch_radius = 1
+    patch_cache_size = 64
+    max_iterations = 8
+
+    def __init__( self , co , tris , target ) :
+        self.co = co
+        self.tris = tris
+        self.lo = co.min( axis = 0 ).astype( np.float64 ) if len(co) else np.zeros(3)
+        self.cell = self.__initial_cell( co , tris , target )
+        self.__patches = collections.OrderedDict()
+
+        for i in range( self.max_iterations ) :
+            # 大きくするのは次の回の頭で (最後の keys と cell を揃える)
+            if i > 0 :
+                self.cell = self.cell * 1.5
+            keys , cluster = np.unique( self.__keys( co ) , return_inverse = True )
+            proxy = self.__collapse( cluster.reshape(-1) )
+            if len(proxy) <= target :
+                break
+
+        counts = np.bincount( cluster.reshape(-1) , minlength = len(keys) ).astype( np.float64 )
+        verts = np.empty( ( len(keys) , 3 ) , dtype = np.float64 )
+        for axis in range(3) :
+            verts[:,axis] = np.bincount( cluster.reshape(-1) , weights = co[:,axis] , minlength = len(keys) ) / np.maximum( counts , 1 )
+        self.bvh = mathutils.bvhtree.BVHTree.FromPolygons( verts.tolist() , proxy.tolist() , epsilon = 0.0 )
+        self.proxy_triangles = len(proxy)
+
+        # 元の三角形を最初の頂点のセルごとにまとめる (CSR)
+        self.cell_keys = keys
+        tri_cell = cluster.reshape(-1)[ tris[:,0] ]
+        self.tri_order = np.argsort( tri_cell , kind = 'stable' ).astype( np.int32 )
+        self.tri_offsets = np.zeros( len(keys) + 1 , dtype = np.int64 )
+        np.cumsum( np.bincount( tri_cell , minlength = len(keys) ) , out = self.tri_offsets[1:] )
+
+    @property
+    def nbytes( self ) :
+        return self.co.nbytes + self.tris.nbytes + self.tri_order.nbytes + self.proxy_triangles * 76
+
+    @staticmethod
+    def __initial_cell( co , tris , target ) :
+        # 表面積を目標の頂点数(三角形数の半分)で割った大きさから始める
+        if len(tris) == 0 :
+            return 1.0
+        a = co[tris[:,1]] - co[tris[:,0]]
+        b = co[tris[:,2]] - co[tris[:,0]]
+        area = 0.5 * np.linalg.norm( np.cross( a , b ) , axis = 1 ).sum( dtype = np.float64 )
+        return max( float( np.sqrt( area / max( target * 0.5 , 1 ) ) ) , 1e-6 )
+
+    def __cells( self , points ) :
+        return np.floor( ( np.asarray( points , dtype = np.float64 ) - self.lo ) / self.cell ).astype( np.int64 )
+
+    def __keys( self , points ) :
+        return np_math.pack_cells( self.__cells( points ) )
+
+    def __collapse( self , cluster ) :
+        t = cluster[ self.tris ]
+        keep = ( t[:,0] != t[:,1] ) & ( t[:,1] != t[:,2] ) & ( t[:,2] != t[:,0] )
+        t = t[keep]
+        if len(t) == 0 :
+            return t
+        # 向きを保ったまま重複を除く
+        rolled = np.take_along_axis( t , ( np.argmin( t , axis = 1 )[:,None] + np.arange(3) ) % 3 , axis = 1 )
+        return np.unique( rolled , axis = 0 )
+
+    def find_nearest( self , point ) :
+        return self.bvh.find_nearest( point )
+
+    def ray_cast( self , origin , direction ) :
+        return self.bvh.ray_cast( origin , direction )
+
+    def find_nearest_exact( self , point ) :
+        hit = self.bvh.find_nearest( point )
+        if hit[0] is None :
+            return hit
+        patch = self.patch( hit[0] )
+        exact = patch.tree.find_nearest( point ) if patch is not None else ( None , None , None , None )
+        if exact[0] is None :
+            # 元の三角形が分からないので番号は -1
+            return hit[0] , hit[1] , -1 , hit[3]
+        return exact[0] , exact[1] , int( patch.ids[exact[2]] ) , exact[3]
+
+    def ray_cast_exact( self , origin , direction ) :
+        hit = self.bvh.ray_cast( origin , direction )
+        if hit[0] is None :
+            return hit
+        patch = self.patch( hit[0] )
+        exact = patch.tree.ray_cast( origin , direction ) if patch is not None else ( None , None , None , None )
+        if exact[0] is None :
+            # 元の三角形が分からないので番号は -1
+            return hit[0] , hit[1] , -1 , hit[3]
+        return exact[0] , exact[1] , int( patch.ids[exact[2]] ) , exact[3]
+
+    def patch( self , position ) :
+        """BVH of the original triangles in the cells around position."""
+        center = self.__cells( ( position[0] , position[1] , position[2] ) )
+        key = int( np_math.pack_cells( center ) )
+        if key in self.__patches :
+            self.__patches.move_to_end(key)
+            return self.__patches[key]
+
+        r = np.arange( -self.patch_radius , self.patch_radius + 1 )
+        around = np.stack( np.meshgrid( r , r , r , indexing = 'ij' ) , axis = -1 ).reshape(-1,3) + center
+        packed = np_math.pack_cells( around )
+        slots = np.searchsorted( self.cell_keys , packed )
+        found = slots < len(self.cell_keys)
+        found[found] = self.cell_keys[ slots[found] ] == packed[found]
+        slots = slots[found]
+        starts = self.tri_offsets[slots]
+        ids = self.tri_order[ np_math.csr_gather( starts , self.tri_offsets[slots + 1] - starts ) ]
+        if len(ids) == 0 :
+            patch = None
+        else :
+            tris = self.tris[ids]
+            verts , local = np.unique( tris.reshape(-1) , return_inverse = True )
+            tree = mathutils.bvhtree.BVHTree.FromPolygons( self.co[verts].tolist() , local.reshape(-1,3).tolist() , epsilon = 0.0 )
+            patch = QSnapPatch( tree , ids )
+
+        self.__patches[key] = patch
+        if len(self.__patches) > self.patch_cache_size :
+            self.__patches.popitem( last = False )
+        return patch
@@ -22,6 +22,7 @@ from .pq_keymap_editor import PQ_OT_DirtyKeymap
 from .gizmo_preselect import * 
 from .pq_preferences import *
 from .translation import pq_translation_dict
+from .QMesh import QSnap
 
 classes = (
     MESH_OT_poly_quilt ,
@@ -51,6 +52,9 @@ def register():
         bpy.utils.register_tool(tool['tool'] ,  after = tool['after'] , group = tool['group'] )
 
 def unregister():
+    QSnap.shutdown()
+    QSnap.tree_cache.clear()
+
     for tool in PolyQuiltTools :
         bpy.utils.unregister_tool(tool['tool'])
 
@@ -25,10 +25,12 @@ import os
 import gc
 from .utils.pqutil import *
 from .utils import draw_util
+from .utils import np_math
 from .utils.dpi import *
 from .pq_icon import *
 from .subtools import *
 from .QMesh import *
+from .QMesh.QMeshLoopCache import QMeshLoopCache
 from .gizmo_preselect import PQ_GizmoGroup_Base            
 import bpy.utils.previews
 
@@ -302,6 +304,7 @@ class MESH_OT_poly_quilt_base(bpy.types.Operator):
             self.currentSubTool.OnInit(context )
 #            self.currentSubTool.Update(context, event)
 
+            np_math.ProjectionWorkspace.trace_memory = self.preferences.is_debug
             if self.preferences.is_debug :
                 self.debugStr = "invoke"
                 self.count = 0
@@ -338,6 +341,17 @@ class MESH_OT_poly_quilt_base(bpy.types.Operator):
                     blf.position(font_id, 15, 20, 0)
                     blf.size(font_id, 20, 72)
                     blf.draw(font_id, self.currentSubTool.Active().name +" > " + self.currentSubTool.Active().debugStr )
+                if self.bmo is not None :
+                    workspace = self.bmo.highlight.workspace
+                    blf.position(font_id, 15, 60, 0)
+                    blf.size(font_id, 20, 72)
+                    blf.draw(font_id, "projection peak = {:.1f}MB buffers = {:.1f}MB".format( workspace.peak_bytes / 1048576 , workspace.nbytes / 1048576 ) )
+                    blf.position(font_id, 15, 80, 0)
+                    blf.size(font_id, 20, 72)
+                    blf.draw(font_id, "loop cache hit = {} miss = {}".format( *QMeshLoopCache.stats() ) )
+                    blf.position(font_id, 15, 100, 0)
+                    blf.size(font_id, 20, 72)
+                    blf.draw(font_id, "snap visibility hit = {} miss = {} rate = {:.0%}".format( *QSnap.visibility_stats() ) )
 
             if self.currentSubTool is not None :
                 self.currentSubTool.Draw2D(context)
@@ -462,7 +476,8 @@ class MESH_OT_poly_quilt_daemon(bpy.types.Operator):
         return {'RUNNING_MODAL'}
 
     @staticmethod
-    def depsgraph_update_post_handler( scene):
+    def depsgraph_update_post_handler( scene , depsgraph = None ):
+        QSnap.depsgraph_update( depsgraph )
         PQ_GizmoGroup_Base.depsgraph_update_post( scene )
 
     @staticmethod
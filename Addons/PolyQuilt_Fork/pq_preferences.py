@@ -140,6 +140,73 @@ class PolyQuiltPreferences(AddonPreferences):
         default=False
     )
 
+    use_depth_buffer : BoolProperty(
+        name="Use Depth Buffer",
+        description="Test hover occlusion against a low resolution depth buffer instead of ray casts",
+        default=False
+    )
+
+    snap_cache_budget : bpy.props.IntProperty(
+        name="Snap Cache Budget",
+        description="Memory budget in MB for snap target BVH trees kept between tool sessions",
+        min = 0,
+        max = 65536,
+        default=1024,
+    )
+
+    snap_target_scope : EnumProperty(
+        name="Snap Targets",
+        description="Which objects are used as snap targets. Objects with the custom property 'polyquilt_snap_exclude' are always skipped",
+        items=[('VISIBLE' , "Visible", "All visible meshes" ),
+               ('SELECTED' , "Selected", "Selected meshes" ),
+               ('COLLECTION' , "Collection", "Visible meshes in the snap target collection" ),
+               ('PROPERTY' , "Property", "Visible meshes with the custom property 'polyquilt_snap_target'" ) ],
+        default='VISIBLE',
+    )
+
+    snap_target_collection : bpy.props.StringProperty(
+        name="Snap Target Collection",
+        description="Collection used when Snap Targets is Collection",
+        default="",
+    )
+
+    use_snap_proxy : BoolProperty(
+        name="Use Snap Proxy",
+        description="Snap to a decimated copy of huge targets while hovering and refine the final positions on the original triangles",
+        default=False
+    )
+
+    snap_proxy_triangles : bpy.props.IntProperty(
+        name="Snap Proxy Triangles",
+        description="Snap targets with more triangles than this are decimated down to about this count",
+        min = 10000,
+        max = 10000000,
+        default=500000,
+    )
+
+    use_snap_field : BoolProperty(
+        name="Use Snap Field",
+        description="Brushes snap through a voxel closest point field sampled around the stroke instead of BVH queries per vertex",
+        default=False
+    )
+
+    snap_field_voxel : bpy.props.FloatProperty(
+        name="Snap Field Voxel",
+        description="Voxel size of the snap field",
+        subtype = 'DISTANCE',
+        min = 0.0001,
+        max = 1.0,
+        default=0.005,
+    )
+
+    depth_buffer_scale : bpy.props.IntProperty(
+        name="Depth Buffer Scale",
+        description="Pixels per depth buffer texel",
+        min = 1,
+        max = 16,
+        default=4,
+    )
+
 
     loopcut_division : bpy.props.IntProperty(
         name="LoopCut DIVISON",
@@ -290,6 +357,20 @@ class PolyQuiltPreferences(AddonPreferences):
             col = layout.column()
             col.scale_y = 1
             layout.row().prop(self, "is_debug" , text = "Debug")
+            row = layout.row()
+            row.prop(self, "use_depth_buffer" , text = "Depth Buffer Occlusion")
+            row.prop(self, "depth_buffer_scale" , text = "Scale")
+            layout.row().prop(self, "snap_cache_budget" , text = "Snap Cache Budget (MB)")
+            row = layout.row()
+            row.prop(self, "snap_target_scope" , text = "Snap Targets")
+            if self.snap_target_scope == 'COLLECTION' :
+                row.prop_search(self, "snap_target_collection" , bpy.data , "collections" , text = "")
+            row = layout.row()
+            row.prop(self, "use_snap_proxy" , text = "Snap Proxy")
+            row.prop(self, "snap_proxy_triangles" , text = "Triangles")
+            row = layout.row()
+            row.prop(self, "use_snap_field" , text = "Brush Snap Field")
+            row.prop(self, "snap_field_voxel" , text = "Voxel")
 
 
 class PQ_OT_SetupUnityLikeKeymap(bpy.types.Operator) :
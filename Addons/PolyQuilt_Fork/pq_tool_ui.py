@@ -16,6 +16,7 @@ import bpy
 from bpy.types import WorkSpaceTool , Panel
 from bpy.utils.toolsystem import ToolDef
 from .pq_icon import *
+from .QMesh import QSnap
 import inspect
 import rna_keymap_ui
 from bpy.app.translations import pgettext_iface as iface_
@@ -121,6 +122,10 @@ def draw_settings_toolheader( operator , context, layout, tool , ui = ['GEOM','B
     popover_kw = {"space_type": 'VIEW_3D', "region_type": 'UI', "category": "Tool"}
     op = layout.popover_group(context=".poly_quilt_option", **popover_kw)
 
+    status = QSnap.build_status()
+    if status :
+        layout.label( text = status , icon = 'TIME' )
+
 
 class VIEW3D_PT_tools_polyquilt_options( Panel):
     bl_space_type = 'VIEW_3D'
@@ -53,7 +53,7 @@ class SubToolBrushMove(SubToolEx) :
         elif event.type == self.rootTool.buttonType : 
             if event.value == 'RELEASE' :
                 if self.verts :
-                    self.bmo.UpdateMesh()
+                    self.bmo.UpdateMesh( changeTopology = False , moved_verts = () )
                     return 'FINISHED'
                 return 'CANCELLED'
         elif event.value == 'RELEASE' :
@@ -142,12 +142,15 @@ class SubToolBrushMove(SubToolEx) :
         zero_pos = self.bmo.zero_pos
         mirror_pos = self.bmo.mirror_pos
 
+        targets = []
         for v,(p,r,co,orig) in self.verts.items() :
             coord = p + move
             x = region_2d_to_location_3d( region = region , rv3d = rv3d , coord = coord , depth_location = co)
-            x = co.lerp( x , 1 - r )
-            x , _ = QSnap.adjust_point( x )
-            x = matrix_inv @ x
+            targets.append( co.lerp( x , 1 - r ) )
+        snapped , _ , _ = QSnap.adjust_points( targets , approximate = True )
+
+        for (v,(p,r,co,orig)) , x in zip( self.verts.items() , snapped.tolist() ) :
+            x = matrix_inv @ mathutils.Vector( x )
             if is_fix_zero and is_x_zero_pos(orig) :
                 x.x = 0 
             v.co = x
@@ -165,7 +168,9 @@ class SubToolBrushMove(SubToolEx) :
                     else :
                         mirror.co = mirror_pos(vert.co)
 
-        self.bmo.UpdateMesh()        
+        moved = list( self.verts.keys() )
+        moved.extend( m for m in self.mirrors.values() if m != None )
+        self.bmo.UpdateMesh( changeTopology = False , moved_verts = moved )
 
     @classmethod
     def GetCursor(cls) :
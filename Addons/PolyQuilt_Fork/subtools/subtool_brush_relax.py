@@ -31,7 +31,6 @@ class SubToolBrushRelax(SubToolEx) :
     def __init__(self, event ,  root) :
         super().__init__(root)
         self.radius = display.dot( self.preferences.brush_size )
-        self.occlusion_tbl = {}
         self.mirror_tbl = {}
         self.dirty = False
         if self.currentTarget.isEmpty or ( self.currentTarget.isEdge and self.currentTarget.element.is_boundary ) :
@@ -70,7 +69,7 @@ class SubToolBrushRelax(SubToolEx) :
         elif event.type == self.rootTool.buttonType : 
             if event.value == 'RELEASE' :
                 if self.dirty  :
-                    self.bmo.UpdateMesh()
+                    self.bmo.UpdateMesh( changeTopology = False , moved_verts = () )
                     return 'FINISHED'
                 return 'CANCELLED'
         elif event.value == 'RELEASE' :
@@ -104,17 +103,14 @@ class SubToolBrushRelax(SubToolEx) :
         bpy.ops.view3d.select_circle( x = int(coord.x) , y = int(coord.y) , radius = int(radius) , wait_for_input=False, mode='SET' )
 #        bm.select_flush(False)
 
-        occlusion_tbl_get = self.occlusion_tbl.get
         is_target = QSnap.is_target
+        # 頂点は毎回動くので位置ではなく頂点番号と形状の版で覚える
+        mesh_key = self.bmo.mesh.as_pointer()
+        version = self.bmo.snapshot_cache.topology_version
         new_vec = mathutils.Vector
         def ProjVert( vt ) :
             co = vt.co
-            is_occlusion = occlusion_tbl_get(vt)
-            if is_occlusion == None :
-                is_occlusion = is_target(matrix_world @ co)
-                self.occlusion_tbl[vt] = is_occlusion
-
-            if not is_occlusion :
+            if not is_target( matrix_world @ co , ( mesh_key , vt.index , version ) ) :
                 return None
 
             pv = matrix @ co.to_4d()
@@ -175,8 +171,8 @@ class SubToolBrushRelax(SubToolEx) :
         zero_pos = self.bmo.zero_pos
         mirror_pos = self.bmo.mirror_pos
 #       matrix_world_inv = matrix_world.inverted()
-        for v , (f,orig) in coords.items() :
-            p = QSnap.adjust_local( matrix_world , v.co , is_fix_zero )
+        snapped , _ = QSnap.adjust_locals( matrix_world , [ v.co for v in coords.keys() ] , is_fix_zero , approximate = True )
+        for ( v , (f,orig) ) , p in zip( coords.items() , snapped.tolist() ) :
             s = orig.lerp( p , f )
             if is_fix_zero and is_x_zero_pos(s) :
                 s = zero_pos(s)
@@ -195,7 +191,10 @@ class SubToolBrushRelax(SubToolEx) :
                     else :
                         mirror.co = mirror_pos(vert.co)
 
-        self.bmo.UpdateMesh(changeTopology = True , loop_triangles = False ,destructive = False )
+        moved = list( coords.keys() )
+        if self.bmo.is_mirror_mode :
+            moved.extend( m for m in mirrors.values() if m != None )
+        self.bmo.UpdateMesh(changeTopology = False , loop_triangles = False ,destructive = False , moved_verts = moved )
 
     @classmethod
     def GetCursor(cls) :
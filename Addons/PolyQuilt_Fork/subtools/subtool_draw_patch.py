@@ -313,18 +313,28 @@ class SubToolDrawPatch(SubTool) :
                         connected_loop.reverse()
         return connected_loop        
 
+    @staticmethod
+    def adjust_verts_by_normal( bmo , verts ) :
+        if not verts :
+            return
+        wps , _ , _ = QSnap.adjust_by_normals( [ bmo.local_to_world_pos(v.co) for v in verts ] , [ bmo.local_to_world_nrm(v.normal) for v in verts ] )
+        matrix_inv = bmo.obj.matrix_world.inverted()
+        for v , wp in zip( verts , wps.tolist() ) :
+            v.co = matrix_inv @ mathutils.Vector(wp)
+
     @staticmethod
     def adjust_faces_normal( bmo , faces , view_vector ) :
         cnt = 0
         for face in faces :
             face.normal_update()
-            normal = face.normal
-            if QSnap.is_active() :
-                center = face.calc_center_median()
-                snappos , snapnrm = QSnap.adjust_by_normal( bmo.local_to_world_pos(center) , bmo.local_to_world_nrm(normal) )
-                cnt = cnt + (1 if snapnrm.dot(normal) > 0 else -1)
-            elif view_vector != None :
-                cnt = cnt - (1 if view_vector.dot(normal) > 0 else -1)
+        if QSnap.is_active() and faces :
+            centers = [ bmo.local_to_world_pos( face.calc_center_median() ) for face in faces ]
+            _ , snapnrms , _ = QSnap.adjust_by_normals( centers , [ bmo.local_to_world_nrm(face.normal) for face in faces ] )
+            for face , snapnrm in zip( faces , snapnrms.tolist() ) :
+                cnt = cnt + (1 if face.normal.dot(snapnrm) > 0 else -1)
+        elif view_vector != None :
+            for face in faces :
+                cnt = cnt - (1 if view_vector.dot(face.normal) > 0 else -1)
         if cnt < 0 :
             for face in faces :
                 face.normal_flip()
@@ -375,9 +385,7 @@ class SubToolDrawPatch(SubTool) :
 #                bmesh.ops.join_triangles(self.bmo, faces = facesets)                        
                 for vert in vertsets :
                     vert.normal_update()
-                for vert in vertsets :
-                    wp , _ = QSnap.adjust_by_normal( bmo.local_to_world_pos(vert.co) , bmo.local_to_world_nrm(vert.normal) )
-                    vert.co = bmo.world_to_local_pos(wp)
+                SubToolDrawPatch.adjust_verts_by_normal( bmo , list(vertsets) )
                 if is_wire :
                     SubToolDrawPatch.adjust_faces_normal( bmo , newFaces , view_vector )
         else :
@@ -398,9 +406,7 @@ class SubToolDrawPatch(SubTool) :
                     vs = [ t for t in div['geom_inner'] if isinstance( t , bmesh.types.BMVert ) ]
                     for v in vs  :
                         v.normal_update()
-                    for v in vs  :
-                        wp , _ = QSnap.adjust_by_normal( bmo.local_to_world_pos(v.co) , bmo.local_to_world_nrm(v.normal) )
-                        v.co = bmo.world_to_local_pos(wp)
+                    SubToolDrawPatch.adjust_verts_by_normal( bmo , vs )
 
         return divide
 
@@ -106,15 +106,16 @@ class move_component_module :
                     if self.bmo.is_x0_snap( self.start_pos + move ) :
                         is_fix_center = True
 
-            for vert , mirror in self.mirror_set.items() :
+            positions = [ wm @ self.verts[vert] + move for vert in self.mirror_set.keys() ]
+            if QSnap.is_active() :
+                if snap_type == 'VIEW' :
+                    positions = [ QSnap.view_adjust(p) for p in positions ]
+                elif snap_type == 'NEAR' :
+                    positions , _ , _ = QSnap.adjust_points( positions )
+                    positions = [ mathutils.Vector(p) for p in positions.tolist() ]
+
+            for ( vert , mirror ) , p in zip( self.mirror_set.items() , positions ) :
                 initial_pos = self.verts[vert]
-                p = wm @ initial_pos
-                p = p + move
-                if QSnap.is_active() :
-                    if snap_type == 'VIEW' :
-                        p = QSnap.view_adjust(p)
-                    elif snap_type == 'NEAR' :
-                        p , _ = QSnap.adjust_point(p)
                 p = im @ p
 
                 if is_center_snap and self.bmo.is_x_zero_pos( initial_pos ) and ( move_center == False or vert not in self.center_verts ) :
@@ -233,12 +234,10 @@ class move_component_module :
         if hitSide == None :
             return None
 
-        side = {} 
-        for v,s in hitSide.items() :
-            p = self.verts[v].lerp( s.co , hp )
-            if QSnap.is_active() :
-                p , _ = QSnap.adjust_point(p)
-            side[v] = p 
+        side = { v : self.verts[v].lerp( s.co , hp ) for v,s in hitSide.items() }
+        if QSnap.is_active() and side :
+            snapped , _ , _ = QSnap.adjust_points( list( side.values() ) )
+            side = { v : mathutils.Vector(p) for v , p in zip( side.keys() , snapped.tolist() ) }
 
         if side :
             for vert , mirror in self.mirror_set.items() :
@@ -1,3 +1,5 @@
+import contextlib
+import tracemalloc
 import numpy as np
 
 
@@ -54,3 +56,205 @@ def IntersectLine2DLines2D( line , lines , isRetPoint = True ) :
         return idx , pts
     else :
         return idx
+
+def IntersectLines2DLines2D( lines_a , lines_b ) :
+    """
+    Every segment of lines_a (A,2,2) against every segment of lines_b (B,2,2).
+    Returns u , the parameter along lines_a , and the hit mask , both (A,B).
+    """
+    p1 = lines_a[:,None,0]
+    t21 = ( lines_a[:,1] - lines_a[:,0] )[:,None]
+    t43 = ( lines_b[:,1] - lines_b[:,0] )[None]
+    t31 = lines_b[None,:,0] - p1
+
+    def cross( a , b ) :
+        return a[...,0] * b[...,1] - a[...,1] * b[...,0]
+
+    d = cross( t21 , t43 )
+    with np.errstate( divide = 'ignore' , invalid = 'ignore' ) :
+        u = cross( t31 , t43 ) / d
+        v = cross( t31 , t21 ) / d
+
+    hit = (d != 0) & (u > 0) & (u < 1) & (v > 0) & (v < 1)
+    return u , hit
+
+def csr_gather( starts , counts ) :
+    """Flat indices of the runs [starts[i] , starts[i]+counts[i]) , concatenated."""
+    total = int( counts.sum() )
+    if total == 0 :
+        return np.empty( 0 , dtype = np.int64 )
+    return np.repeat( starts - np.cumsum(counts) + counts , counts ) + np.arange( total )
+
+def spatial_hash( cells ) :
+    """Hash of integer cells (...,3) ; collisions are left to the caller's distance test."""
+    return ( cells[...,0] * 73856093 ) ^ ( cells[...,1] * 19349663 ) ^ ( cells[...,2] * 83492791 )
+
+def pack_cells( cells ) :
+    """Integer cells (...,3) packed 21 bits per axis into int64 (|cell| < 2^20)."""
+    c = cells + ( 1 << 20 )
+    return ( c[...,0] << 42 ) | ( c[...,1] << 21 ) | c[...,2]
+
+class BufferPool :
+    """Named numpy buffers reused while their capacity is enough."""
+
+    def __init__( self ) :
+        self.__buffers = {}
+
+    def buffer( self , name , shape , dtype = np.float32 ) :
+        size = int(np.prod(shape))
+        buf = self.__buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < size :
+            buf = np.empty( max( size , 1 ) , dtype = dtype )
+            self.__buffers[name] = buf
+        return buf[:size].reshape(shape)
+
+    def clear( self ) :
+        self.__buffers.clear()
+
+    @property
+    def nbytes( self ) :
+        return sum( b.nbytes for b in self.__buffers.values() )
+
+class SpatialGrid2D :
+    """
+    Uniform grid over screen-space points (n,2) or segments (n,2,2).
+    query() returns a superset of the rows near a circle; the caller
+    still runs the exact distance test on those rows only.
+    """
+    max_span = 16
+
+    def __init__( self , bounds , cell_size , count ) :
+        self.cell = float( max( cell_size , 1.0 ) )
+        self.origin = bounds[0]
+        size = np.maximum( bounds[1] - bounds[0] , 0 )
+        self.cols = int( size[0] // self.cell ) + 1
+        self.rows = int( size[1] // self.cell ) + 1
+        self.count = count
+        self.items = np.empty( 0 , dtype = np.int64 )
+        self.offsets = np.zeros( self.cols * self.rows + 1 , dtype = np.int64 )
+        self.extras = np.empty( 0 , dtype = np.int64 )
+
+    @classmethod
+    def from_points( cls , points , cell_size ) :
+        points = points.reshape(-1,2)
+        if len(points) == 0 :
+            return cls( np.zeros((2,2), dtype = np.float32) , cell_size , 0 )
+        grid = cls( ( points.min(axis=0) , points.max(axis=0) ) , cell_size , len(points) )
+        cx , cy = grid.cell_of( points )
+        grid.__store( cy * grid.cols + cx , np.arange( len(points) ) )
+        return grid
+
+    @classmethod
+    def from_lines( cls , lines , cell_size ) :
+        lines = lines.reshape(-1,2,2)
+        if len(lines) == 0 :
+            return cls( np.zeros((2,2), dtype = np.float32) , cell_size , 0 )
+        lo = lines.min(axis=1)
+        hi = lines.max(axis=1)
+        grid = cls( ( lo.min(axis=0) , hi.max(axis=0) ) , cell_size , len(lines) )
+        x0 , y0 = grid.cell_of( lo )
+        x1 , y1 = grid.cell_of( hi )
+        w = x1 - x0 + 1
+        h = y1 - y0 + 1
+
+        # 長すぎる線分はセルに入れず毎回検査する
+        big = ( w > cls.max_span ) | ( h > cls.max_span )
+        grid.extras = np.flatnonzero( big )
+        ids = np.flatnonzero( ~big )
+        w , h , x0 , y0 = w[ids] , h[ids] , x0[ids] , y0[ids]
+
+        # 各線分の外接矩形に含まれるセルへ展開
+        n = w * h
+        rep = np.repeat( ids , n )
+        local = np.arange( n.sum() ) - np.repeat( np.cumsum(n) - n , n )
+        rw = np.repeat( w , n )
+        cx = np.repeat( x0 , n ) + local % rw
+        cy = np.repeat( y0 , n ) + local // rw
+        grid.__store( cy * grid.cols + cx , rep )
+        return grid
+
+    def cell_of( self , points ) :
+        c = ( ( points - self.origin ) // self.cell ).astype( np.int64 )
+        return np.clip( c[:,0] , 0 , self.cols - 1 ) , np.clip( c[:,1] , 0 , self.rows - 1 )
+
+    def __store( self , keys , ids ) :
+        order = np.argsort( keys , kind = 'stable' )
+        self.items = ids[order]
+        np.cumsum( np.bincount( keys , minlength = self.cols * self.rows ) , out = self.offsets[1:] )
+
+    def add_extras( self , ids ) :
+        # 移動した行は古いセルに残るが、ここに入れておけば必ず候補になる
+        self.extras = np.union1d( self.extras , ids )
+
+    def query( self , center , radius ) :
+        lo = np.asarray( center , dtype = np.float32 ) - radius
+        hi = np.asarray( center , dtype = np.float32 ) + radius
+        x0 , y0 = self.cell_of( lo.reshape(1,2) )
+        x1 , y1 = self.cell_of( hi.reshape(1,2) )
+        xs = np.arange( x0[0] , x1[0] + 1 )
+        ys = np.arange( y0[0] , y1[0] + 1 )
+        keys = ( ys[:,None] * self.cols + xs[None,:] ).ravel()
+
+        starts = self.offsets[keys]
+        found = self.items[ csr_gather( starts , self.offsets[keys + 1] - starts ) ]
+        if len(self.extras) > 0 :
+            found = np.concatenate( ( found , self.extras ) )
+        return np.unique( found )
+
+class ProjectionWorkspace( BufferPool ) :
+    """
+    Preallocated buffers for projecting object-space points to region pixels.
+    Buffers grow to the largest mesh seen and are reused between view changes;
+    with trace_memory the allocation peak of the last projection is kept in peak_bytes.
+    """
+    trace_memory = False
+
+    def __init__( self ) :
+        super().__init__()
+        self.peak_bytes = 0
+
+    @contextlib.contextmanager
+    def measure( self ) :
+        if not self.trace_memory :
+            yield
+            return
+        started = not tracemalloc.is_tracing()
+        if started :
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        try :
+            yield
+        finally :
+            self.peak_bytes = tracemalloc.get_traced_memory()[1] - base
+            if started :
+                tracemalloc.stop()
+
+    def project( self , points , matrix , width , height , coords , visible ) :
+        """
+        points (n,3) float32 , matrix transposed (4,4) float32.
+        Writes region coords (n,3) and the in-view mask (n,) into the given arrays.
+        """
+        n = len(points)
+        clip = self.buffer( 'clip' , (n,4) )
+        np.dot( points , matrix[:3] , out = clip )
+        clip += matrix[3]
+
+        np.divide( clip[:,:3] , clip[:,3:4] , out = coords )
+        coords *= np.array( ( width / 2 , height / 2 , 1 ) , dtype = np.float32 )
+        coords += np.array( ( width / 2 , height / 2 , 0 ) , dtype = np.float32 )
+
+        # 範囲内チェック
+        tmp = self.buffer( 'mask' , (n,) , bool )
+        np.less( coords[:,2] , 1.0 , out = visible )
+        visible &= np.greater_equal( coords[:,0] , 0 , out = tmp )
+        visible &= np.less_equal( coords[:,0] , width , out = tmp )
+        visible &= np.greater_equal( coords[:,1] , 0 , out = tmp )
+        visible &= np.less_equal( coords[:,1] , height , out = tmp )
+        return coords , visible
+
+    def gather( self , name , source , index ) :
+        """source[index] written into a reused buffer."""
+        out = self.buffer( name , index.shape + source.shape[1:] , source.dtype )
+        np.take( source , index , axis = 0 , out = out )
+        return out
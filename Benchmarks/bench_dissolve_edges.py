@@ -0,0 +1,90 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Edge loop dissolve time vs. loop length.
+#
+#   blender -b --factory-startup --python Benchmarks/bench_dissolve_edges.py
+
+import os
+import sys
+import math
+import time
+import bpy
+import bmesh
+
+sys.path.append( os.path.join( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) , "Addons" ) )
+from PolyQuilt_Fork.QMesh.QMeshOperators import QMeshOperators
+
+SIZES = ( 10 , 100 , 1_000 , 10_000 )
+
+def make_strip( bm , count ) :
+    # 2列の帯 , 真ん中の横の辺が内側のループ
+    bm.clear()
+    bmesh.ops.create_grid( bm , x_segments = count , y_segments = 2 , size = 1.0 )
+    bm.verts.ensure_lookup_table()
+    bm.edges.ensure_lookup_table()
+    bm.faces.ensure_lookup_table()
+    return [ e for e in bm.edges if abs( e.verts[0].co.y ) < 1e-6 and abs( e.verts[1].co.y ) < 1e-6 ]
+
+def dissolve_legacy( bm , edges , dissolve_vert_angle = 180 ) :
+    verts = {}
+    for e in edges :
+        verts[ e.verts[0] ] = e.is_wire
+        verts[ e.verts[1] ] = e.is_wire
+    for edge in edges :
+        if edge.is_valid :
+            if edge.is_boundary or edge.is_wire :
+                bmesh.ops.delete( bm , geom = [edge] , context = 'EDGES' )
+            else :
+                bmesh.ops.dissolve_edges( bm , edges = [edge] , use_verts = False , use_face_split = False )
+    bmesh.ops.delete( bm , geom = [ v for v , w in verts.items() if v.is_valid and len(v.link_edges) == 0 ] , context = 'VERTS' )
+    bmesh.ops.delete( bm , geom = [ v for v , w in verts.items() if v.is_valid and len(v.link_edges) == 1 and not w ] , context = 'VERTS' )
+    removes = []
+    for vert in [ v for v in verts if v.is_valid and len(v.link_edges) == 2 ] :
+        n0 = (vert.link_edges[0].other_vert(vert).co - vert.co).normalized()
+        n1 = (vert.link_edges[1].other_vert(vert).co - vert.co).normalized()
+        r = math.ceil( math.degrees( math.acos( max( min( n0.dot(n1) , 1 ) , -1 ) ) ) )
+        if r > dissolve_vert_angle :
+            removes.append(vert)
+    if removes :
+        bmesh.ops.dissolve_verts( bm , verts = removes , use_face_split = False , use_boundary_tear = False )
+
+def measure( bm , count , func , repeat = 3 ) :
+    best = float('inf')
+    for _ in range(repeat) :
+        edges = make_strip( bm , count )
+        t = time.perf_counter()
+        func( edges )
+        best = min( best , time.perf_counter() - t )
+    return best , ( len(bm.verts) , len(bm.edges) , len(bm.faces) )
+
+def main() :
+    mesh = bpy.data.meshes.new( "bench_dissolve" )
+    obj = bpy.data.objects.new( "bench_dissolve" , mesh )
+    bpy.context.scene.collection.objects.link( obj )
+    bpy.context.view_layer.objects.active = obj
+    bpy.ops.object.mode_set( mode = 'EDIT' )
+    ops = QMeshOperators( obj , None )
+    bm = ops.bm
+
+    print( "{:>10} {:>12} {:>12} {:>8}".format( "edges" , "legacy[ms]" , "batched[ms]" , "ratio" ) )
+    for size in SIZES :
+        legacy , legacy_result = measure( bm , size , lambda edges : dissolve_legacy( bm , edges ) )
+        batched , batched_result = measure( bm , size , lambda edges : ops.dissolve_edges( edges , is_mirror = False ) )
+        assert legacy_result == batched_result , ( legacy_result , batched_result )
+        print( "{:>10} {:>12.1f} {:>12.1f} {:>7.1f}x".format( size , legacy * 1000 , batched * 1000 , legacy / batched ) )
+
+    bpy.ops.object.mode_set( mode = 'OBJECT' )
+
+if __name__ == "__main__":
+    main()
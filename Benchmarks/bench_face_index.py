@@ -0,0 +1,70 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Face-by-vertex-set lookup : hash collision check and lookup time vs. face count.
+#
+#   blender -b --factory-startup --python Benchmarks/bench_face_index.py
+
+import os
+import sys
+import time
+import bmesh
+import numpy as np
+
+sys.path.append( os.path.join( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) , "Addons" ) )
+from PolyQuilt_Fork.QMesh.QMeshSnapshot import QMeshSnapshot
+
+SIZES = ( 10_000 , 100_000 , 1_000_000 )
+
+def check_collision() :
+    # {1,5,6} と {2,3,7} は和も二乗和も同じ
+    bm = bmesh.new()
+    verts = [ bm.verts.new( ( i , i * i , 0 ) ) for i in range(8) ]
+    bm.faces.new( [ verts[i] for i in ( 1 , 5 , 6 ) ] )
+    bm.faces.new( [ verts[i] for i in ( 2 , 3 , 7 ) ] )
+    bm.verts.index_update()
+    snapshot = QMeshSnapshot()
+    snapshot.update( bm )
+    found = snapshot.find_faces( np.array( [ 6 , 1 , 5 , 7 , 2 , 3 , 1 , 2 , 3 ] ) , [ 0 , 3 , 6 ] )
+    assert found.tolist() == [ 0 , 1 , -1 ] , found
+    bm.free()
+
+def make_grid( count ) :
+    bm = bmesh.new()
+    seg = int( count ** 0.5 )
+    bmesh.ops.create_grid( bm , x_segments = seg , y_segments = seg , size = 1.0 )
+    bm.verts.index_update()
+    return bm
+
+def main() :
+    check_collision()
+    print( "{:>10} {:>12} {:>12}".format( "faces" , "index[ms]" , "lookup[ms]" ) )
+    for size in SIZES :
+        bm = make_grid( size )
+        snapshot = QMeshSnapshot()
+        snapshot.update( bm )
+        # 全ての面を頂点を回した順で引く
+        starts = snapshot.faces_loop_start
+        verts = np.roll( snapshot.loops_vert.reshape(-1,4) , 1 , axis = 1 ).reshape(-1)
+        t = time.perf_counter()
+        snapshot.face_keys()
+        index = time.perf_counter() - t
+        t = time.perf_counter()
+        found = snapshot.find_faces( verts , starts )
+        lookup = time.perf_counter() - t
+        assert np.array_equal( found , np.arange( len(starts) ) )
+        print( "{:>10} {:>12.1f} {:>12.1f}".format( len(starts) , index * 1000 , lookup * 1000 ) )
+        bm.free()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+# Topology snapshot extraction time vs. vertex count.
+#
+#   blender -b --factory-startup --python Benchmarks/bench_snapshot.py
+
+import os
+import sys
+import time
+import bmesh
+import numpy as np
+
+sys.path.append( os.path.join( os.path.dirname( os.path.dirname( os.path.abspath(__file__) ) ) , "Addons" ) )
+from PolyQuilt_Fork.QMesh.QMeshSnapshot import QMeshSnapshot
+
+SIZES = ( 10_000 , 100_000 , 1_000_000 , 3_000_000 )
+
+def make_grid( count ) :
+    bm = bmesh.new()
+    seg = int( count ** 0.5 )
+    bmesh.ops.create_grid( bm , x_segments = seg , y_segments = seg , size = 1.0 )
+    bm.verts.ensure_lookup_table()
+    bm.edges.ensure_lookup_table()
+    return bm
+
+def extract_legacy( bm ) :
+    vts = bm.verts
+    vlen = len(vts)
+    edges = bm.edges
+    elen = len(edges)
+    co = np.fromiter( [x for v in vts for x in v.co], dtype=np.float32, count = vlen*3).reshape((vlen, 3))
+    idx = np.fromiter( [v.index for e in edges for v in e.verts ], dtype=np.int32, count = elen *2)
+    return co , idx
+
+def extract_snapshot( bm , snapshot ) :
+    snapshot.invalidate()
+    snapshot.update( bm )
+    return snapshot.verts_co , snapshot.edges_idx
+
+def measure( func , repeat = 3 ) :
+    best = float('inf')
+    for _ in range(repeat) :
+        t = time.perf_counter()
+        func()
+        best = min( best , time.perf_counter() - t )
+    return best
+
+def main() :
+    snapshot = QMeshSnapshot()
+    print( "{:>10} {:>12} {:>12} {:>8}".format( "verts" , "legacy[ms]" , "snapshot[ms]" , "ratio" ) )
+    for size in SIZES :
+        bm = make_grid( size )
+        legacy = measure( lambda : extract_legacy(bm) )
+        bulk = measure( lambda : extract_snapshot(bm,snapshot) )
+        co , idx = extract_legacy(bm)
+        assert np.array_equal( co , snapshot.verts_co )
+        assert np.array_equal( idx , snapshot.edges_idx.reshape(-1) )
+        print( "{:>10} {:>12.1f} {:>12.1f} {:>7.1f}x".format( len(bm.verts) , legacy * 1000 , bulk * 1000 , legacy / bulk ) )
+        bm.free()
+
+if __name__ == "__main__":
+    main()